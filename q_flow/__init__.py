@@ -9,8 +9,8 @@ The file env.json is used to store the secret keys
 
 from json import dumps
 from flask import Config, Flask, jsonify, g
-from q_flow.command import create_cf
-from q_flow.extensions import db, fs, lg, u_api, mail, er, cors
+from q_flow.command import create_cf, migrate_cf, recompute_cf, simulate_cf, upgrade_db
+from q_flow.extensions import db, fs, lg, u_api, g_auth, mail, er, cors
 
 def create_app(config_class=Config):
     app = Flask(__name__)
@@ -20,10 +20,15 @@ def create_app(config_class=Config):
     lg.init_app(app)
     db.init_app(app)
     u_api.init_app(app)
+    g_auth.init_app(app)
     mail.init_app(app)
     er.init_app(app)
     cors.init_app(app)
     app.cli.add_command(create_cf)
+    app.cli.add_command(upgrade_db)
+    app.cli.add_command(migrate_cf)
+    app.cli.add_command(simulate_cf)
+    app.cli.add_command(recompute_cf)
 
     # @app.after_request
     # def add_token_to_response(response):
@@ -0,0 +1,109 @@
+'''
+Cash position analytics of a project from its inflow and outflow.
+
+The functions work on the last axis so the same pass is used for one
+cashflow (1-D series) or for many cashflows at once (one row per cashflow,
+e.g. the iterations of simulation.py):
+1. align: pads the inflow and the outflow to the same length
+2. net position: inflow - outflow and its cumulative sum
+3. peak exposure: the lowest cumulative net position (the funding needed by
+    the project) and the period it is reached
+4. npv: the net position discounted at the interest rate (per period)
+5. irr: the rate (per period) where the npv is zero, the root closest to
+    zero if there are several
+6. financing cost: the interest on the overdraft (the negative cumulative
+    net position) at the interest rate, not compounded
+'''
+import numpy as np
+
+IRR_GRID = np.linspace(-0.5, 1.0, 151)
+IRR_STEPS = 50
+
+
+def align(inflow, outflow) -> tuple:
+    '''
+    Returns the inflow and the outflow as arrays padded with zeros to the
+    same length
+    '''
+    inflow = np.asarray(inflow, dtype=float)
+    outflow = np.asarray(outflow, dtype=float)
+    length = max(inflow.shape[-1], outflow.shape[-1])
+    def pad(series):
+        widths = [(0, 0)] * (series.ndim - 1) + [(0, length - series.shape[-1])]
+        return np.pad(series, widths)
+    return pad(inflow), pad(outflow)
+
+
+def npv(net, rate) -> np.ndarray:
+    '''
+    Net present value of the net position (the first period is not
+    discounted). rate can be an array broadcasting with net[..., 0].
+    '''
+    rate = np.asarray(rate, dtype=float)[..., None]
+    t = np.arange(net.shape[-1])
+    return (net / (1 + rate) ** t).sum(axis=-1)
+
+
+def irr(net) -> np.ndarray:
+    '''
+    Internal rate of return per period. The advance payment and the retention
+    release make the net position change sign more than once, so the npv can
+    have several roots: the npv is evaluated on IRR_GRID and the root
+    closest to zero is refined by bisection. nan where the npv does not
+    change sign on the grid (e.g. the project is never in deficit).
+    '''
+    grid = npv(net[..., None, :], IRR_GRID)
+    changes = np.sign(grid[..., :-1]) * np.sign(grid[..., 1:]) < 0
+    valid = changes.any(axis=-1)
+    distance = np.where(changes, np.abs(IRR_GRID[:-1] + IRR_GRID[1:]), np.inf)
+    bracket = distance.argmin(axis=-1)
+    low, high = IRR_GRID[bracket], IRR_GRID[bracket + 1]
+    npv_low = npv(net, low)
+    for _ in range(IRR_STEPS):
+        mid = (low + high) / 2
+        npv_mid = npv(net, mid)
+        same = np.sign(npv_mid) == np.sign(npv_low)
+        low = np.where(same, mid, low)
+        npv_low = np.where(same, npv_mid, npv_low)
+        high = np.where(same, high, mid)
+    return np.where(valid, (low + high) / 2, np.nan)
+
+
+def analyze(inflow, outflow, rate, lengths=None) -> dict:
+    '''
+    Returns the analytics of the cashflow as arrays (scalars for 1-D series).
+    lengths: the number of periods of each cashflow when the rows are padded
+    to a common length, the overdraft is not financed after the end.
+    '''
+    inflow, outflow = align(inflow, outflow)
+    net = inflow - outflow
+    cumulative = np.cumsum(net, axis=-1)
+    overdraft = np.maximum(-cumulative, 0)
+    if lengths is not None:
+        overdraft *= np.arange(net.shape[-1]) < np.asarray(lengths)[..., None]
+    return {
+        "net": net,
+        "cumulative_net": cumulative,
+        "peak_exposure": np.minimum(cumulative.min(axis=-1), 0),
+        # 0 if the position is never negative, like peak_exposure
+        "peak_exposure_month": np.where(cumulative.min(axis=-1) < 0, cumulative.argmin(axis=-1), 0),
+        "npv": npv(net, rate),
+        "irr": irr(net),
+        "financing_cost": overdraft.sum(axis=-1) * rate,
+    }
+
+
+def as_json(analytics: dict) -> dict:
+    '''
+    The analytics of one cashflow as JSON values (irr is None if undefined)
+    '''
+    irr = float(analytics["irr"])
+    return {
+        "net": analytics["net"].tolist(),
+        "cumulative_net": analytics["cumulative_net"].tolist(),
+        "peak_exposure": float(analytics["peak_exposure"]),
+        "peak_exposure_month": int(analytics["peak_exposure_month"]),
+        "npv": float(analytics["npv"]),
+        "irr": None if np.isnan(irr) else irr,
+        "financing_cost": float(analytics["financing_cost"]),
+    }
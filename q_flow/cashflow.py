@@ -10,13 +10,19 @@ How to use the cashflow class:
 5. Create a Project_cf object for the project
 6. Generate the inflow for the project
 7. Generate the outflow for the project
-'''
 
-from itertools import zip_longest
-from math import exp
-from re import sub
+Activity_cf and Project_cf adapt the models to engine.py which computes the
+cashflows from the plain parameters of params.py.
+'''
 
 import click
+import numpy as np
+from sqlalchemy import null, select, update
+from q_flow import curves, engine
+from q_flow.engine import ActivityCashFlow, CashFlowAggregate
+from q_flow.extensions import db
+from q_flow.params import ActivityParams, ProjectParams
+from q_flow.series import Series
 from q_flow.models.activity import Activity
 from matplotlib import pyplot as plt
 from asciichartpy import plot
@@ -37,169 +43,174 @@ class Work():
         self.c = c
         self.ct = ct
 
-    def __skewed(self, t):
-        '''
-        this method will return the total work performed at time (t) for a
-        project with cost (c), duration (d) and skewing factor (s)
-        '''
-        # conditions
-        assert self.s > -1 and self.s < 1
-        assert t >= 0 and t <= self.d
-
-        if self.ct == "l":
-            return self.c/self.d * t
-        return self.c*(self.s+1)/(
-            (self.s+1)+exp(
-                -(t/(0.1*self.d)+self.s**2-5)
-            )
-        )
-
-    def __raw_cumulative_work(self) -> list:
-        '''
-        This method returns the cumulative work performed at each unit of time
-        if uses the skewed method without adjusting for error.
-        d: duration
-        s: skew (-0.9, 0.9)
-        c: cost
-        '''
-        t_work = []
-        for t in range(0, self.d + 1):
-            t_work.append(self.__skewed(t))
-        return t_work
-
     def marginal_work(self) -> list:
         '''
         This method uses the raw cumulative work to calculate the marginal work
         from S curve to sigmoid curve. It adjusts for error in the work performed
+        (see curves.py).
         '''
-        m_work = []
-        t_work = self.__raw_cumulative_work()
-        for t in range(0, self.d):
-            if t <=  self.d:
-                m_work.append(t_work[t+1] - t_work[t])
-
-        # calculate the error
-        er = self.c - sum(m_work)
-
-        # apply third degree polynomial to distribute the error
-        # the error should be distributed over the duration of the activity
-        # on the cumulative work.
-        d = self.d
-        for t in range(0, d + 1):
-            error_dist = -(2*er*t**3)/(d**3) + (3*er*t**2)/(d**2)
-            t_work[t] = t_work[t] + error_dist
-
-        adjusted_m_work = []
-        for t in range(0, d):
-            if t <= d:
-                adjusted_m_work.append(t_work[t+1] - t_work[t])
-
-        return adjusted_m_work
+        return curves.marginal_work(self.d, self.s, self.c, self.ct).tolist()
 
     def cumulative_work(self) -> list:
         '''
         this method uses the error adjusted marginal work to create a new 
         cumulative S curve.
         '''
-        d = self.d
-        mWork = self.marginal_work()
-        t_work = [mWork[0]]
-        for t in range(1, d):
-            t_work.append(mWork[t] + t_work[t-1])
-        return t_work
+        return np.cumsum(
+            curves.marginal_work(self.d, self.s, self.c, self.ct)).tolist()
 
 class Project_cf():
+    '''
+    Given a Project Object, this class will generate the inflow and the
+    outflow of the project from the aggregate of its (not deleted) activities
+    cashflows. The aggregate is read from Project.cash_flow_json and built
+    from the activities only when it is missing (see Project_cf.rebuild).
+    The contract terms are read once (ProjectParams) and the cashflow is
+    computed by engine.py.
+    '''
     def __init__(self, project: Project) -> None:
         self.project = project
-        self.work_cf = []
-        self.outflow_cf = []
-
-        work_dur = []
-        work_total = []
-        out_dur = []
-        out_total = []
-        activity: Activity
-        activities = project.activities
+        if project.cash_flow_json is None:
+            self.aggregate = self.rebuild(project)
+        else:
+            self.aggregate = CashFlowAggregate(project.cash_flow_json)
+        self.terms = ProjectParams.of(project)
+        self.duration = self.aggregate.duration
+        self.cost = self.aggregate.cost
+
+    @staticmethod
+    def rebuild(project: Project) -> CashFlowAggregate:
+        '''
+        Sums the cashflows of all the not deleted activities of the project and
+        stores the result in project.cash_flow_json.
+        A stored project is written (and committed) only if its
+        cash_flow_version, read before the activities, is unchanged (see
+        update_activity): an activity changed while the aggregate was summed
+        otherwise and the aggregate is not stored. The activities whose
+        cashflow is computed here bump the version too, their project is
+        stored at the next rebuild.
+        '''
+        if not isinstance(project, Project):
+            # an overlay (see scenario.py), nothing is stored
+            aggregate = Project_cf._sum(project.activities)
+            project.cash_flow_json = aggregate.as_json()
+            return aggregate
+
+        table = Project.__table__
+        version = db.func.coalesce(table.c.cash_flow_version, 0)
+        read_version = db.session.execute(
+            select(version).where(table.c.id == project.id)).scalar()
+        activities = (Activity.query.filter(Activity.project_id == project.id)
+            .execution_options(populate_existing=True).all())
+        aggregate = Project_cf._sum(activities)
+        db.session.execute(
+            update(table)
+            .where(table.c.id == project.id, version == read_version)
+            .values(cash_flow_json=aggregate.as_json(),
+                updated_at=table.c.updated_at, timestamp=table.c.timestamp))
+        db.session.commit()
+        return aggregate
+
+    @staticmethod
+    def _sum(activities: list) -> CashFlowAggregate:
+        activities = [a for a in activities if not a.is_deleted]
+
+        # build the missing activity cashflows in one batch
+        missing = [a for a in activities if not a.cash_flow_json]
+        for activity_cf in Activity_cf.batch(missing):
+            activity_cf.activity.cash_flow_json = activity_cf.as_json()
+
+        aggregate = CashFlowAggregate()
         for activity in activities:
-            if not activity.cash_flow_json:
-                activity_cf = Activity_cf(activity)
-                activity.cash_flow_json = {}
-                activity.cash_flow_json.update(activity_cf.marginal_work_as_json())
-                activity.cash_flow_json.update(activity_cf.out_flow_as_json())
-            activity_cf_json = activity.cash_flow_json
-            activity_work: list = activity_cf_json.get("marginal_work")
-            activity_outflow: list = activity_cf_json.get("marginal_out_flow")
-            # # adjust for start
-            # for _ in range(0, activity.start):
-            #     activity_work.insert(0, 0)
-            #     activity_outflow.insert(0, 0)
-            # project cashflow matrix
-            self.work_cf.append(activity_work)
-            self.outflow_cf.append(activity_outflow)
-            work_dur.append(len(activity_work))
-            work_total.append(sum(activity_work))
-            out_dur.append(len(activity_outflow))
-            out_total.append(sum(activity_outflow))
-
-        self.duration = max(work_dur)
-        self.cost = sum(work_total)
+            aggregate.add(activity.cash_flow_json)
+        return aggregate
+
+    @staticmethod
+    def update_activity(project: Project, old: dict = None, new: dict = None) -> None:
+        '''
+        Updates the stored aggregate of the project when the cashflow of one of
+        its activities changes from old to new (None when the activity is
+        created, deleted or restored) and commits it. If the project has no
+        stored aggregate nothing is done, it is built from all the activities
+        when needed.
+        The aggregate is written only if the cash_flow_version read with it
+        is unchanged (the version is bumped by each write and by each change
+        of the activities), otherwise a concurrent change could be lost: the
+        aggregate is then cleared and rebuilt when the project is next read.
+        '''
+        if project is None:
+            return
+        table = Project.__table__
+        version = db.func.coalesce(table.c.cash_flow_version, 0)
+        row = db.session.execute(
+            select(table.c.cash_flow_json, version.label('version'))
+            .where(table.c.id == project.id)).one_or_none()
+        if row is None or row.cash_flow_json is None:
+            return
+        aggregate = CashFlowAggregate(row.cash_flow_json)
+        aggregate.subtract(old)
+        aggregate.add(new)
+        # the timestamps are kept (see Project.commit_cash_flow)
+        values = dict(cash_flow_version=version + 1,
+            updated_at=table.c.updated_at, timestamp=table.c.timestamp)
+        written = db.session.execute(
+            update(table)
+            .where(table.c.id == project.id, version == row.version)
+            .values(cash_flow_json=aggregate.as_json(), **values)).rowcount
+        if not written:
+            db.session.execute(
+                update(table)
+                .where(table.c.id == project.id)
+                .values(cash_flow_json=null(), **values))
+        db.session.commit()
 
     def factored_work(self) -> list:
         '''
         this method calculates the inflow for the project. It sums the cashflow
         of all activities and adjusts for the contract value.
         '''
-        t_work = [sum(n) for n in zip_longest(*self.work_cf, fillvalue=0)]
-        factor = self.project.contract_value / self.cost
-        t_work = [n * factor for n in t_work]
-        return t_work
+        return engine.factored_work(self.terms, self.aggregate.work).tolist()
 
-    def inflow(self) -> list:
+    def inflow_series(self) -> Series:
         '''
-        This method calculates the inflow considering:
-        1. advance payment
-        2. retention
-        3. dlp
-        4. duration for payment
-        5. release retention at eop
-        6. release retention at dlp
-        7. activity work
-        '''
-        inflow = []
-        # add advance payment
-        inflow.append(self.project.advance * self.project.contract_value)
-
-        # add 0 for the duration for payment
-        for _ in range(0, self.project.duration_for_payment):
-            inflow.append(0)
-
-        # add the factored work
-        previous_work = 0
-        for work in self.factored_work():
-            bill_work = work *(1 - self.project.wieb) + previous_work * self.project.wieb
-            previous_work = work
-            inflow.append((1-(self.project.advance + self.project.retention)) * bill_work)
-        inflow.append(
-            (1-(self.project.advance + self.project.retention)) * previous_work * self.project.wieb)
-
-        # add retention release at eop as per contract
-        inflow[-1] += self.project.retention * self.project.contract_value * self.project.release_retention_eop
-
-        # add zeros for the dlp
-        for _ in range(1, self.project.dlp):
-            inflow.append(0)
-
-        # add retention release at dlp as per contract
-        inflow.append(self.project.retention * self.project.contract_value * (1 - self.project.release_retention_eop))
-        return inflow
+        The inflow of the project as a sparse series (see engine.project_inflow)
+        '''
+        return engine.project_inflow(self.terms, self.aggregate.work)
+
+    def inflow(self) -> list:
+        return self.inflow_series().to_list()
 
     def outflow(self) -> list:
         '''
         This method calculates the outflow for the project. It sums the cashflow
         of all activities and adjusts for the contract value.
         '''
-        outflow = [sum(n) for n in zip_longest(*self.outflow_cf, fillvalue=0)]
-        return outflow
+        return self.aggregate.out_flow.tolist()
+
+    def analytics(self, inflow: list = None, outflow: list = None) -> dict:
+        '''
+        Net position, peak exposure, npv, irr and financing cost of the project
+        at its interest rate (see analytics.py)
+        '''
+        return engine.project_analytics(
+            self.terms,
+            self.inflow() if inflow is None else inflow,
+            self.outflow() if outflow is None else outflow)
+
+    def as_json(self) -> dict:
+        '''
+        The computed cashflow of the project as stored in
+        Project.cash_flow_snapshot
+        '''
+        inflow = self.inflow_series()
+        outflow = self.aggregate.out_flow
+        return {
+            "format": Project.SNAPSHOT_FORMAT,
+            "inflow": inflow.as_json(),
+            "outflow": Series.from_dense(outflow).as_json(),
+            "factored_work": self.factored_work(),
+            "analytics": self.analytics(inflow.to_dense(), outflow),
+        }
 
     def print_project_cashflow(self):
         cf = self
@@ -284,160 +295,133 @@ class Activity_cf():
     once this period is over, so it’s essential that this date is set with 
     precision to ensure accurate scheduling and billing.
     '''
-    def __init__(self, activity: Activity) -> None:
+    # activity fields the cashflow depends on. The derived series are cached
+    # and the cache is cleared when any of these fields changes.
+    PARAMETERS = (
+        "duration", "skew", "cost", "activity_type", "start",
+        "mobilization_period", "no_billing_period", "subcontracted",
+        "work_in_excess", "retention", "advance", "duration_for_payment",
+        "dlp", "release_retention_eop",
+    )
+
+    def __init__(self, activity: Activity, marginal_work: list = None) -> None:
+        '''
+        marginal_work: the work curve of the activity if it was already
+        computed (see Activity_cf.batch), otherwise it is computed here.
+
+        The work curve is kept without the mobilization period, the zeros of
+        the mobilization period are an offset (no_work) applied by the stages.
+        '''
         self.activity = activity
-        if activity.activity_type == "linear":
-            self.work = Work(
-                self.activity.duration, self.activity.skew, self.activity.cost, "l")
-        else:
+        self._cache_key = None
+        self._check_cache()
+        if marginal_work is not None:
+            self.cash_flow = ActivityCashFlow(self.params, marginal_work)
+
+    def _check_cache(self) -> ActivityCashFlow:
+        '''
+        Returns the engine cashflow of the activity (see engine.py), a new one
+        if the activity parameters changed since it was created.
+        '''
+        key = tuple(getattr(self.activity, p) for p in self.PARAMETERS)
+        if key != self._cache_key:
+            self._cache_key = key
+            params = self.params = ActivityParams.of(self.activity)
+            self.cash_flow = ActivityCashFlow(params)
             self.work = Work(
-                self.activity.duration, self.activity.skew, self.activity.cost)
-        self.marginal_work = self.work.marginal_work()
+                params.duration, params.skew, params.cost,
+                "l" if params.linear else "s")
+            self.no_work = params.mobilization_period
+        return self.cash_flow
 
-        # add 0's for mobilization period
-        for _ in range(0, self.activity.mobilization_period):
-            self.marginal_work.insert(0, 0)
+    def invalidate(self) -> None:
+        '''Clears the cached series'''
+        self._cache_key = None
 
-    def subcontractor_bill_work(self) -> list:
+    @classmethod
+    def batch(cls, activities: list) -> list:
         '''
-        From the marginal work, this method calculates the work that will be
-        billed by the subcontractor. result is marginal
+        Creates an Activity_cf for each activity computing all the work curves
+        in one call (see ActivityCashFlow.batch).
         '''
-        sub_bill_work = []
-        m_work = self.marginal_work
-        no_work = self.activity.mobilization_period
-        no_bill = self.activity.no_billing_period
+        cash_flows = ActivityCashFlow.batch([ActivityParams.of(a) for a in activities])
+        return [cls(a, cf.work_curve) for a, cf in zip(activities, cash_flows)]
 
-        # fill zeros for the no billing period
-        for _ in range(0, no_bill):
-            sub_bill_work.append(0)
+    @property
+    def work_curve(self) -> np.ndarray:
+        '''
+        The marginal work without the mobilization period
+        '''
+        return self._check_cache().work_curve
 
-        # add the first bill after the no billing period which is the sum of the
-        # work performed during the no billing period
-        first_bill_work = 0
-        if no_bill > 0:
-            first_bill_work = sum(m_work[0:(no_bill + 1)]) * self.activity.subcontracted
-        else:
-            first_bill_work = m_work[0] * self.activity.subcontracted
-        sub_bill_work.append(first_bill_work)
-
-        # remaining bill work:
-        for t in range(no_bill + 1, self.activity.duration + no_work):
-            sub_bill_work.append(m_work[t]*self.activity.subcontracted)
-
-        # WIEB: work in excess of billing
-        # adjust for WIEB work_in_excess of billing. this is the work that is
-        # billed in the next billing period
-        adjusted_sub_bill_work = []
-        for t in range(0, len(sub_bill_work) + 1):
-            if t == 0:
-                adjusted_work = (sub_bill_work[t] * \
-                    (1 - self.activity.work_in_excess))
-            elif t == len(sub_bill_work):
-                adjusted_work = (sub_bill_work[t-1] * \
-                    self.activity.work_in_excess)
-            else:
-                adjusted_work = (
-                    sub_bill_work[t] * (1 - self.activity.work_in_excess)
-                    + sub_bill_work[t-1] * self.activity.work_in_excess
-                )
-            # adjust for retention and advance recovery
-            adjusted_sub_bill_work.append(adjusted_work * \
-                (1 - self.activity.retention - self.activity.advance))
+    @property
+    def marginal_work(self) -> np.ndarray:
+        '''
+        The work curve including the zeros of the mobilization period
+        '''
+        return self._check_cache().marginal_work
 
-        return adjusted_sub_bill_work
+    def cumulative_work(self) -> np.ndarray:
+        '''
+        The cumulative work curve without the mobilization period
+        '''
+        return self._check_cache().cumulative_work()
 
-    def sub_payments(self) -> list:
+    def subcontractor_bill_work(self) -> np.ndarray:
+        '''
+        From the marginal work, this method calculates the work that will be
+        billed by the subcontractor. result is marginal
+        '''
+        return self._check_cache().subcontractor_bill_work()
+
+    def sub_payments(self) -> np.ndarray:
         '''
         Having the subcontractor bill work, this method calculates the payments
         that will be made to the subcontractor. result is marginal.
         '''
-        sub_payments = []
-        sub_bill_work = self.subcontractor_bill_work()
-
-        # add zeros to the duration_for_payment
-        for _ in range(0, self.activity.duration_for_payment):
-            sub_payments.append(0.0)
-
-        # add remaining payments
-        for payment in sub_bill_work:
-            sub_payments.append(payment)
-
-        # add advance payment
-        sub_payments[0] = sub_payments[0] + self.activity.advance * self.activity.cost * self.activity.subcontracted
-
-        # return 50% of retention
-        value_of_retention = self.activity.cost * self.activity.subcontracted * \
-            self.activity.retention
-        sub_payments[-1] += value_of_retention * self.activity.release_retention_eop
-
-        # return the remaining 50% of retention at the end of dlp
-        for _ in range(1, self.activity.dlp):
-            sub_payments.append(0.0)
-        sub_payments[-1] += value_of_retention * (1-self.activity.release_retention_eop)
-        return sub_payments
+        return self._check_cache().sub_payments()
 
-    def non_sub_payments(self) -> list:
+    def non_sub_payments(self) -> np.ndarray:
         '''
-        this method uses the marginal work list to calculate the payments that
+        this method uses the marginal work to calculate the payments that
         will be made to the non subcontractors. result is marginal.
         '''
-        non_sub_payments = []
-        m_work = self.marginal_work
-        # add zero to period 1 --- removed
-        # non_sub_payments.append(0)
-        # pay all bills
-        for t in range(0, len(m_work)):
-            non_sub_payments.append(m_work[t] * (1-self.activity.subcontracted))
+        return self._check_cache().non_sub_payments()
 
-        return non_sub_payments
-
-    def out_flow(self) -> list:
+    def out_flow(self) -> np.ndarray:
         '''
         this method calculates the total outflow for the activity. It sums the
         subcontractor payments and the non subcontractor payments. result is
         marginal.
         '''
-        sub_payments = self.sub_payments()
-        non_sub_payments = self.non_sub_payments()
-        outflow = [sum(n) for n in zip_longest(
-            sub_payments, non_sub_payments, fillvalue=0)]
-        return outflow
+        return self._check_cache().out_flow()
 
     def marginal_work_as_json(self):
         # adjust for start
-        m_work = [] 
-        for _ in range(0, self.activity.start):
-            m_work.insert(0, 0.0)
-        m_work.extend(self.marginal_work)
-        return {
-            "marginal_work": m_work,
-        }
+        return {"marginal_work": self.as_json()["marginal_work"]}
 
     def out_flow_as_json(self):
         # adjust for start
-        out = []
-        for _ in range(0, self.activity.start):
-            out.insert(0, 0.0)
-        out.extend(self.out_flow())
-        return {
-            "marginal_out_flow": out,
-        }
+        return {"marginal_out_flow": self.as_json()["marginal_out_flow"]}
+
+    def as_json(self) -> dict:
+        '''
+        The cashflow of the activity as stored in Activity.cash_flow_json
+        '''
+        return self._check_cache().as_json()
 
     def set_cashflow(self):
         '''
         This method will set the cashflow for the activity and commit it to the
         database. keys are: marginal_work, marginal_out_flow
         '''
-        self.activity.cash_flow_json = {}
-        self.activity.cash_flow_json.update(self.marginal_work_as_json())
-        self.activity.cash_flow_json.update(self.out_flow_as_json())
+        self.activity.cash_flow_json = self.as_json()
         self.activity.commit()
 
     def printCashFlow(self, with_chart=False, with_text_chart=False, detailed=False):
         cf = self
-        wr = cf.work.marginal_work()
-        cw = cf.work.cumulative_work()
+        wr = cf.work_curve
+        cw = cf.cumulative_work()
         sub = cf.subcontractor_bill_work()
         sub_pay = cf.sub_payments()
         non_sub = cf.non_sub_payments()
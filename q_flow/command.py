@@ -1,7 +1,15 @@
 import click
 from flask.cli import with_appcontext
+from sqlalchemy import JSON, inspect, text
+from q_flow.extensions import db
 from q_flow.models.activity import Activity
+from q_flow.models.project import Project
 from q_flow.cashflow import Activity_cf
+from q_flow.recompute import activity_filters, recompute
+from q_flow.simulation import simulate
+from time import perf_counter
+import json
+import os
 import random
 
 @click.command("createcf")
@@ -51,3 +59,113 @@ def create_cf(
 def random_type():
     types = ["critical", "non-critical", "normal", ""]
     return random.choice(types)
+
+
+@click.command("upgrade-db")
+@with_appcontext
+def upgrade_db():
+    '''
+    db.create_all only creates the missing tables. This command adds the
+    columns of the models that are missing from the existing tables.
+    '''
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            db.session.execute(text(
+                f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+            click.echo(f"added column {table.name}.{column.name}")
+    db.session.commit()
+
+
+@click.command("migrate-cf")
+@click.option("--batch-size", "-b", default=500, help="Activities per transaction")
+@click.option("--vacuum", is_flag=True, help="Reclaim the freed space (sqlite)")
+@with_appcontext
+def migrate_cf(batch_size: int, vacuum: bool):
+    '''
+    Converts the activities cashflow stored as JSON (cash_flow_json column) to
+    the packed binary format (cash_flow_data column). Run upgrade-db first to
+    add the cash_flow_data column to an existing database.
+    '''
+    query = Activity.query.filter(
+        Activity.cash_flow_data.is_(None),
+        Activity.legacy_cash_flow_json.isnot(None),
+        # rows holding a JSON null have no cashflow to convert
+        Activity.legacy_cash_flow_json != JSON.NULL,
+        )
+    total = query.count()
+    click.echo(f"{total} activities to migrate")
+    migrated, last_id = 0, None
+    while True:
+        batch = query.order_by(Activity.id)
+        if last_id is not None:
+            batch = batch.filter(Activity.id > last_id)
+        activities = batch.limit(batch_size).all()
+        if not activities:
+            break
+        last_id = activities[-1].id
+        for activity in activities:
+            # the setter packs the series and clears the JSON column
+            activity.cash_flow_json = activity.legacy_cash_flow_json
+        db.session.commit()
+        migrated += len(activities)
+        click.echo(f"migrated {migrated}/{total}")
+    if vacuum:
+        with db.engine.connect().execution_options(
+                isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(text("VACUUM"))
+
+
+@click.command("simulate")
+@click.argument("project_id")
+@click.option("--iterations", "-i", default=10000, help="Number of iterations")
+@click.option("--processes", "-p", default=1, help="Number of worker processes")
+@click.option("--seed", "-s", type=int, help="Seed of the random generator")
+@click.option("--config", "-c", type=click.File(), help="JSON file of distributions")
+@click.option("--output", "-o", type=click.File("w"), default="-", help="Output JSON file")
+@with_appcontext
+def simulate_cf(project_id, iterations: int, processes: int, seed: int, config, output):
+    '''
+    Runs the Monte Carlo simulation of a project (see simulation.py) as a
+    background job and writes the percentile bands as JSON.
+    '''
+    project = Project.query.get(project_id)
+    if project is None:
+        raise click.ClickException(f"Project {project_id} not found")
+    result = simulate(project, config={
+        "iterations": iterations,
+        "processes": processes,
+        "seed": seed,
+        "distributions": json.load(config) if config else None,
+        })
+    json.dump(result, output)
+
+
+@click.command("recompute-cf")
+@click.option("--project", "-p", "project_ids", multiple=True, help="Only the activities of the project (repeatable)")
+@click.option("--type", "-t", "activity_type", help="Only the activities of the activity type")
+@click.option("--user", "-u", "user_id", help="Only the activities created by the user")
+@click.option("--missing", is_flag=True, help="Only the activities without a cashflow")
+@click.option("--reset-skew", is_flag=True, help="Set the skew to the default of the activity type")
+@click.option("--processes", "-n", default=os.cpu_count() or 1, help="Number of worker processes")
+@click.option("--batch-size", "-b", default=1000, help="Activities per transaction")
+@with_appcontext
+def recompute_cf(project_ids, activity_type, user_id, missing: bool, reset_skew: bool,
+        processes: int, batch_size: int):
+    '''
+    Recomputes the cashflow of the activities (see recompute.py) over a pool
+    of worker processes, the projects cashflows are rebuilt when next read.
+    '''
+    started = perf_counter()
+    def progress(done, total):
+        elapsed = perf_counter() - started
+        click.echo(f"recomputed {done}/{total} ({done / elapsed:.0f}/s)")
+    filters = activity_filters(project_ids, activity_type, user_id, missing)
+    done = recompute(filters, processes, batch_size, reset_skew, progress)
+    click.echo(f"{done} activities recomputed in {perf_counter() - started:.1f}s")
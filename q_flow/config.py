@@ -40,9 +40,32 @@ class Config(object):
     MAIL_ALLOWED_RETRIES = 3
     MAIL_DOMAIN = 'snaghere.com'
 
+    # Monte Carlo simulation settings (see simulation.py)
+    SIMULATION_MAX_ITERATIONS = 20000
+    SIMULATION_PROCESSES = 1
+
+    # Maximum number of points of a sensitivity grid (see sensitivity.py)
+    SENSITIVITY_MAX_POINTS = 10000
+
     # JWT settings
     USER_API_URL = 'https://quollnet.com/api/user/'
+    # verified user tokens cached until their exp (see services/token_cache.py)
+    TOKEN_CACHE_SIZE = 1024
+    # QAuth HTTP sessions (see services/user_api.py), timeouts in seconds
+    USER_API_POOL_SIZE = 10
+    USER_API_RETRIES = 2
+    USER_API_BACKOFF = 0.3
+    USER_API_CONNECT_TIMEOUT = 3.05
+    USER_API_READ_TIMEOUT = 30
+    # expired tokens refresh (see services/single_flight.py)
+    TOKEN_REFRESH_FAILURE_TTL = 5
+    TOKEN_MAX_REFRESHES = 1
     GOOGLE_DISCOVERY_URL = 'https://accounts.google.com/.well-known/openid-configuration'
+    # Google sign-in (see services/google_auth.py), timeouts in seconds
+    GOOGLE_CONNECT_TIMEOUT = 3.05
+    GOOGLE_READ_TIMEOUT = 10
+    GOOGLE_USERINFO_TTL = 60
+    GOOGLE_CERTS_MIN_REFRESH = 60
 
     # Load secret keys from file
     ENV_FILE = 'env.json'
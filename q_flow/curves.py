@@ -0,0 +1,213 @@
+'''
+NumPy engine for the work S-curves used by the cashflow module.
+
+All the functions work on whole arrays instead of evaluating the curve one
+month at a time, one row per activity:
+1. the sigmoid (or linear) cumulative curve at t = 0..d is adjusted by the
+    cubic error polynomial so it ends at the cost. The polynomial and its diff
+    are computed once per duration (cubic_basis).
+2. marginal_work: the monthly work, the diff of the adjusted cumulative curve
+3. batch_marginal_work: the marginal work of many activities in one call.
+    Activities are grouped by duration and each group is computed as one
+    broadcasted 2-D array (one row per activity).
+The cumulative work of an activity is the cumsum of its marginal work (see
+engine.ActivityCashFlow).
+
+The marginal work is linear in the cost, so the curve of a given
+(d, s, ct) is computed once for a unit cost and kept in the process-wide LRU
+cache `unit_curves`. The cached arrays are shared read-only buffers, the
+curve of an activity is the unit curve multiplied by its cost.
+
+d: Duration
+s: Skewing factor between -0.9 and +0.9
+c: Cost
+ct: "s" for sigmoid and "l" for linear
+'''
+
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+
+import numpy as np
+
+
+class CurveCache():
+    '''
+    Bounded LRU cache of unit curves keyed by (d, s, ct). Stored arrays are
+    made read-only so they can be shared between callers.
+    '''
+    def __init__(self, maxsize=4096) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._curves = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            curve = self._curves.get(key)
+            if curve is None:
+                self.misses += 1
+                return None
+            self._curves.move_to_end(key)
+            self.hits += 1
+            return curve
+
+    def put(self, key, curve: np.ndarray) -> np.ndarray:
+        curve.flags.writeable = False
+        with self._lock:
+            self._curves[key] = curve
+            self._curves.move_to_end(key)
+            while len(self._curves) > self.maxsize:
+                self._curves.popitem(last=False)
+        return curve
+
+    def clear(self) -> None:
+        with self._lock:
+            self._curves.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._curves),
+            "maxsize": self.maxsize,
+        }
+
+
+unit_curves = CurveCache()
+
+
+def cache_info() -> dict:
+    '''Returns the hit/miss counters and the size of the unit curve cache'''
+    return unit_curves.info()
+
+
+def _key(d, s, ct) -> tuple:
+    return (int(d), float(s), "l" if ct == "l" else "s")
+
+
+def _raw_cumulative_rows(d, s, c, linear) -> np.ndarray:
+    '''
+    Returns the raw cumulative work of a group of activities sharing the same
+    duration. s, c and linear are 1-D arrays (one value per activity) and the
+    result has the shape (len(s), d + 1). The skews are between -1 and 1 (see
+    params.py).
+    '''
+    t = np.arange(d + 1, dtype=float)
+    s = s[:, None]
+    c = c[:, None]
+    t_work = c * (s + 1) / ((s + 1) + np.exp(-(t / (0.1 * d) + s**2 - 5)))
+    if linear.any():
+        t_work[linear] = c[linear] / d * t
+    return t_work
+
+
+@lru_cache(maxsize=1024)
+def cubic_basis(d) -> tuple:
+    '''
+    Returns the (read-only) error redistribution polynomial 3(t/d)^2 - 2(t/d)^3
+    at t = 0..d and its marginal (diff) over the d periods
+    '''
+    x = np.arange(d + 1, dtype=float) / d
+    cumulative = x * x * (3 - 2 * x)
+    marginal = np.diff(cumulative)
+    cumulative.flags.writeable = False
+    marginal.flags.writeable = False
+    return cumulative, marginal
+
+
+def _error(t_work, c) -> np.ndarray:
+    # the cost not performed by the raw curve, as a column
+    return (c - (t_work[:, -1] - t_work[:, 0]))[:, None]
+
+
+def _marginal_rows(d, s, c, linear) -> np.ndarray:
+    '''
+    Returns the marginal work of a group of activities (see
+    _raw_cumulative_rows), shape (len(s), d). The error (the difference
+    between the cost and the work performed by the raw curve) is distributed
+    over the duration by the third degree polynomial 3(t/d)^2 - 2(t/d)^3, so
+    this is the diff of the raw curve plus the error times the cached
+    marginal of the polynomial.
+    '''
+    t_work = _raw_cumulative_rows(d, s, c, linear)
+    m_work = np.diff(t_work, axis=1)
+    m_work += _error(t_work, c) * cubic_basis(d)[1]
+    return m_work
+
+
+def _as_rows(s, c, ct):
+    return (
+        np.array([s], dtype=float),
+        np.array([c], dtype=float),
+        np.array([ct == "l"]),
+    )
+
+
+def unit_marginal_work(d, s, ct="s") -> np.ndarray:
+    '''
+    Returns the (cached, read-only) marginal work of an activity of unit cost.
+    '''
+    key = _key(d, s, ct)
+    curve = unit_curves.get(key)
+    if curve is None:
+        curve = unit_curves.put(key, _marginal_rows(d, *_as_rows(s, 1.0, ct))[0])
+    return curve
+
+
+def marginal_work(d, s, c, ct="s") -> np.ndarray:
+    '''
+    Returns the error adjusted work performed in each of the d periods.
+    '''
+    return unit_marginal_work(d, s, ct) * c
+
+
+def batch_marginal_work(durations, skews, costs, curve_types, padded=False):
+    '''
+    Returns the marginal work of N activities. The inputs are sequences of
+    length N. The result is a list of N arrays (ragged, in the input order) or,
+    if padded is True, a 2-D array of shape (N, max(durations)) where each row
+    is padded with zeros after the end of the activity.
+    '''
+    durations = np.asarray(durations, dtype=int)
+    skews = np.asarray(skews, dtype=float)
+    costs = np.asarray(costs, dtype=float)
+    linear = np.asarray(curve_types) == "l"
+
+    n = len(durations)
+    if padded:
+        result = np.zeros((n, durations.max(initial=0)))
+    else:
+        result = [None] * n
+
+    for d in np.unique(durations):
+        rows = np.flatnonzero(durations == d)
+
+        # look up the unit curves of the group and compute the missing ones
+        # in one broadcasted call
+        keys = [_key(d, skews[i], "l" if linear[i] else "s") for i in rows]
+        units = {}
+        for key in keys:
+            if key not in units:
+                units[key] = unit_curves.get(key)
+        missing = [key for key, curve in units.items() if curve is None]
+        if missing:
+            m_work = _marginal_rows(
+                int(d),
+                np.array([key[1] for key in missing]),
+                np.ones(len(missing)),
+                np.array([key[2] == "l" for key in missing]),
+            )
+            for key, curve in zip(missing, m_work):
+                units[key] = unit_curves.put(key, curve.copy())
+
+        m_work = np.array([units[key] for key in keys]) * costs[rows, None]
+        if padded:
+            result[rows, :d] = m_work
+        else:
+            for i, row in zip(rows, m_work):
+                result[i] = row
+    return result
@@ -0,0 +1,334 @@
+'''
+Cashflow engine: the activity and project cashflows computed with NumPy from
+the plain parameters of params.py, without the models.
+
+The engine does not need an app context, a database session or the model
+instances, so batch jobs, commands and worker processes can use it directly.
+cashflow.py is the adapter: Activity_cf and Project_cf read the parameters
+of the models (ActivityParams.of, ProjectParams.of) and delegate to the
+engine.
+
+    params = ActivityParams(duration=6, skew=0.0, cost=1000.0, ...)
+    cash_flow = ActivityCashFlow(params).as_json()
+    aggregate = CashFlowAggregate()
+    aggregate.add(cash_flow)
+    inflow = project_inflow(ProjectParams(...), aggregate.work)
+'''
+import numpy as np
+
+from q_flow import analytics, curves
+from q_flow.exceptions import InvalidData
+from q_flow.params import ActivityParams, ProjectParams
+from q_flow.series import Series
+
+
+def with_offset(series: np.ndarray, offset: int) -> np.ndarray:
+    '''
+    Returns the series (on its last axis) preceded by offset zeros.
+    '''
+    series = np.asarray(series, dtype=float)
+    result = np.zeros(series.shape[:-1] + (offset + series.shape[-1],))
+    result[..., offset:] = series
+    return result
+
+
+def sub_bill_work(work_curve, no_work, no_bill, subcontracted, work_in_excess,
+        retention, advance) -> np.ndarray:
+    '''
+    Work billed by the subcontractor (marginal). work_curve is the marginal work
+    without the no_work (mobilization) period which is an offset of zeros.
+    work_curve can be a 2-D array (one curve per row) in which case the
+    parameters can be scalars or 1-D arrays (one value per row).
+    '''
+    work_curve = np.asarray(work_curve, dtype=float)
+    lead = work_curve.shape[:-1]
+    subcontracted = np.asarray(subcontracted, dtype=float)[..., None]
+    work_in_excess = np.asarray(work_in_excess, dtype=float)[..., None]
+    end = no_work + work_curve.shape[-1]
+    n = max(end, no_bill + 1)
+
+    # zeros for the no billing period then the first bill which is the sum of
+    # the work performed during the no billing period
+    bill = np.zeros(lead + (n,))
+    first = no_bill + 1 - no_work
+    if first > 0:
+        bill[..., no_bill] = np.cumsum(
+            work_curve[..., :first], axis=-1)[..., -1] * subcontracted[..., 0]
+
+    # remaining bill work
+    start = max(no_bill + 1, no_work)
+    bill[..., start:end] = work_curve[..., start - no_work:] * subcontracted
+
+    # WIEB: work in excess of billing. this is the work that is billed in the
+    # next billing period
+    adjusted = np.zeros(lead + (n + 1,))
+    adjusted[..., :n] += bill * (1 - work_in_excess)
+    adjusted[..., 1:] += bill * work_in_excess
+
+    # adjust for retention and advance recovery
+    return adjusted * (1 - np.asarray(retention)[..., None]
+        - np.asarray(advance)[..., None])
+
+
+def sub_payments(bill_work, duration_for_payment, dlp, cost, subcontracted,
+        advance, retention, release_retention_eop) -> np.ndarray:
+    '''
+    Payments to the subcontractor (marginal) given the bill work. The payments
+    are shifted by the duration for payment, the advance is paid at the first
+    period and the retention is released at the end of the work and at the end
+    of the dlp.
+    '''
+    bill_work = np.asarray(bill_work, dtype=float)
+    n = duration_for_payment + bill_work.shape[-1]
+    payments = np.zeros(bill_work.shape[:-1] + (n + max(dlp - 1, 0),))
+    payments[..., duration_for_payment:n] = bill_work
+
+    # add advance payment
+    payments[..., 0] += advance * cost * subcontracted
+
+    # return the retention at the end of work and the remaining at end of dlp
+    value_of_retention = cost * subcontracted * retention
+    payments[..., n - 1] += value_of_retention * release_retention_eop
+    payments[..., -1] += value_of_retention * (1 - release_retention_eop)
+    return payments
+
+
+def out_flow(sub_payments, work_curve, no_work, subcontracted) -> np.ndarray:
+    '''
+    Total outflow (marginal): the subcontractor payments plus the non
+    subcontractor payments which are paid as the work is performed.
+    '''
+    sub_payments = np.asarray(sub_payments, dtype=float)
+    work_curve = np.asarray(work_curve, dtype=float)
+    end = no_work + work_curve.shape[-1]
+    outflow = np.zeros(
+        sub_payments.shape[:-1] + (max(sub_payments.shape[-1], end),))
+    outflow[..., :sub_payments.shape[-1]] += sub_payments
+    outflow[..., no_work:end] += work_curve * (
+        1 - np.asarray(subcontracted, dtype=float)[..., None])
+    return outflow
+
+
+class CashFlowAggregate():
+    '''
+    Running sum of the activities cashflows of a project. An activity
+    contribution (its cash_flow_json) can be added or subtracted in
+    O(activity length), so editing one activity does not require summing all
+    the activities of the project again.
+
+    The lengths of the summed series are counted so the aggregate shrinks back
+    when the longest activity is removed. The aggregate is stored in
+    Project.cash_flow_json (see as_json).
+    '''
+    def __init__(self, data: dict = None) -> None:
+        data = data or {}
+        self.work = np.array(data.get("marginal_work", []), dtype=float)
+        self.out_flow = np.array(data.get("marginal_out_flow", []), dtype=float)
+        self.work_lengths = {
+            int(k): v for k, v in data.get("work_lengths", {}).items()}
+        self.out_flow_lengths = {
+            int(k): v for k, v in data.get("out_flow_lengths", {}).items()}
+
+    @staticmethod
+    def _add(total, lengths, series, sign) -> np.ndarray:
+        series = np.asarray(series, dtype=float)
+        n = len(series)
+        if n > len(total):
+            total = np.concatenate([total, np.zeros(n - len(total))])
+        total[:n] += sign * series
+
+        lengths[n] = lengths.get(n, 0) + sign
+        if lengths[n] <= 0:
+            del lengths[n]
+        if not lengths:
+            return np.zeros(0)
+        return total[:max(lengths)]
+
+    def add(self, cash_flow_json: dict, sign=1) -> None:
+        '''
+        Adds (sign=1) or subtracts (sign=-1) the cashflow of an activity
+        '''
+        if not cash_flow_json:
+            return
+        self.work = self._add(
+            self.work, self.work_lengths,
+            cash_flow_json.get("marginal_work", []), sign)
+        self.out_flow = self._add(
+            self.out_flow, self.out_flow_lengths,
+            cash_flow_json.get("marginal_out_flow", []), sign)
+
+    def subtract(self, cash_flow_json: dict) -> None:
+        self.add(cash_flow_json, sign=-1)
+
+    @property
+    def duration(self) -> int:
+        return len(self.work)
+
+    @property
+    def cost(self) -> float:
+        return float(self.work.sum())
+
+    def as_json(self) -> dict:
+        return {
+            "marginal_work": self.work.tolist(),
+            "marginal_out_flow": self.out_flow.tolist(),
+            "work_lengths": {str(k): v for k, v in self.work_lengths.items()},
+            "out_flow_lengths": {
+                str(k): v for k, v in self.out_flow_lengths.items()},
+        }
+
+
+class ActivityCashFlow():
+    '''
+    The cashflow stages of one activity (see sub_bill_work, sub_payments and
+    out_flow). Each series is computed at most once and kept as a read-only
+    array.
+    '''
+    __slots__ = ('params', '_cache')
+
+    def __init__(self, params: ActivityParams, work_curve=None) -> None:
+        '''
+        work_curve: the work curve of the activity if it was already computed
+        (see ActivityCashFlow.batch), otherwise it is computed when needed.
+        '''
+        self.params = params
+        self._cache = {}
+        if work_curve is not None:
+            self._cache["work_curve"] = read_only(work_curve)
+
+    @classmethod
+    def batch(cls, params: list) -> list:
+        '''
+        Creates an ActivityCashFlow for each params computing all the work
+        curves in one call to curves.batch_marginal_work.
+        '''
+        work_curves = curves.batch_marginal_work(
+            [p.duration for p in params],
+            [p.skew for p in params],
+            [p.cost for p in params],
+            ["l" if p.linear else "s" for p in params],
+        )
+        return [cls(p, curve) for p, curve in zip(params, work_curves)]
+
+    def _cached(self, name, compute) -> np.ndarray:
+        series = self._cache.get(name)
+        if series is None:
+            series = self._cache[name] = read_only(compute())
+        return series
+
+    @property
+    def work_curve(self) -> np.ndarray:
+        '''
+        The marginal work without the mobilization period
+        '''
+        p = self.params
+        return self._cached("work_curve", lambda: curves.marginal_work(
+            p.duration, p.skew, p.cost, "l" if p.linear else "s"))
+
+    @property
+    def marginal_work(self) -> np.ndarray:
+        '''
+        The work curve including the zeros of the mobilization period
+        '''
+        return self._cached("marginal_work", lambda: with_offset(
+            self.work_curve, self.params.mobilization_period))
+
+    def cumulative_work(self) -> np.ndarray:
+        return self._cached(
+            "cumulative_work", lambda: np.cumsum(self.work_curve))
+
+    def subcontractor_bill_work(self) -> np.ndarray:
+        p = self.params
+        return self._cached("subcontractor_bill_work", lambda: sub_bill_work(
+            self.work_curve, p.mobilization_period, p.no_billing_period,
+            p.subcontracted, p.work_in_excess, p.retention, p.advance))
+
+    def sub_payments(self) -> np.ndarray:
+        p = self.params
+        return self._cached("sub_payments", lambda: sub_payments(
+            self.subcontractor_bill_work(), p.duration_for_payment, p.dlp,
+            p.cost, p.subcontracted, p.advance, p.retention,
+            p.release_retention_eop))
+
+    def non_sub_payments(self) -> np.ndarray:
+        p = self.params
+        return self._cached("non_sub_payments", lambda: with_offset(
+            self.work_curve * (1 - p.subcontracted), p.mobilization_period))
+
+    def out_flow(self) -> np.ndarray:
+        p = self.params
+        return self._cached("out_flow", lambda: out_flow(
+            self.sub_payments(), self.work_curve, p.mobilization_period,
+            p.subcontracted))
+
+    def as_json(self) -> dict:
+        '''
+        The cashflow of the activity from the start of the project, as stored
+        in Activity.cash_flow_json
+        '''
+        p = self.params
+        return {
+            "marginal_work": with_offset(
+                self.work_curve, p.start + p.mobilization_period).tolist(),
+            "marginal_out_flow": with_offset(self.out_flow(), p.start).tolist(),
+        }
+
+
+def read_only(series) -> np.ndarray:
+    series = np.array(series, dtype=float)
+    series.flags.writeable = False
+    return series
+
+
+def factored_work(terms: ProjectParams, work: np.ndarray) -> np.ndarray:
+    '''
+    The work of the project (the sum of the activities work) adjusted for the
+    contract value
+    '''
+    cost = float(np.sum(work))
+    InvalidData.require_condition(cost > 0, 'The project has no cost')
+    return np.asarray(work, dtype=float) * (terms.contract_value / cost)
+
+
+def project_inflow(terms: ProjectParams, work: np.ndarray) -> Series:
+    '''
+    The inflow of the project considering:
+    1. advance payment
+    2. retention
+    3. dlp
+    4. duration for payment
+    5. release retention at eop
+    6. release retention at dlp
+    7. activity work
+    The months without payment (the duration for payment and the dlp) are
+    not stored (see series.py).
+    '''
+    cv = terms.contract_value
+    work = factored_work(terms, work)
+
+    # the work is billed in the month and the work in excess (wieb) in the
+    # next month
+    bill_work = np.zeros(len(work) + 1)
+    bill_work[:-1] += work * (1 - terms.wieb)
+    bill_work[1:] += work * terms.wieb
+    bill_work *= 1 - (terms.advance + terms.retention)
+
+    # add retention release at eop as per contract
+    bill_work[-1] += terms.retention * cv * terms.release_retention_eop
+
+    start = 1 + terms.duration_for_payment
+    release = start + len(bill_work) + max(terms.dlp - 1, 0)
+    return Series(release + 1, [
+        (0, [terms.advance * cv]),
+        (start, bill_work),
+        # add retention release at dlp as per contract
+        (release, [terms.retention * cv * (1 - terms.release_retention_eop)]),
+        ])
+
+
+def project_analytics(terms: ProjectParams, inflow, outflow) -> dict:
+    '''
+    Net position, peak exposure, npv, irr and financing cost of the project
+    at its interest rate (see analytics.py)
+    '''
+    return analytics.as_json(analytics.analyze(inflow, outflow, terms.interest_rate))
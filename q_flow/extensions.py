@@ -3,7 +3,9 @@ from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from q_flow.services.err_handler import ErrHandler
 from q_flow.services.file_sys import FileSys
+from q_flow.services.google_auth import GoogleAuth
 from q_flow.services.logger import QLogger
+from q_flow.services.async_user_api import AsyncUser_API
 from q_flow.services.user_api import User_API
 from flask_mail import Mail
 
@@ -11,6 +13,8 @@ lg = QLogger()
 db = SQLAlchemy()
 fs = FileSys()
 u_api = User_API()
+au_api = AsyncUser_API(u_api)
+g_auth = GoogleAuth()
 mail = Mail()
 er = ErrHandler()
 cors = CORS()
\ No newline at end of file
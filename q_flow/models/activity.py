@@ -1,8 +1,11 @@
 
 from enum import Enum
+from sqlalchemy import event, inspect, update
 from typing_extensions import deprecated
 from q_flow.extensions import db
 from q_flow.models.mixins import BaseMixin
+from q_flow.models.project import Project
+from q_flow.services import cash_flow_codec
 
 class ActivityType(Enum):
     GENERAL = ("General", 0)
@@ -40,7 +43,14 @@ class ActivityType(Enum):
 
 class Activity(db.Model, BaseMixin):
     name = db.Column(db.String(64))
-    cash_flow_json = db.Column(db.JSON)
+
+    # The cashflow series (marginal_work, marginal_out_flow) packed by
+    # services/cash_flow_codec.py. Use the cash_flow_json property to read or
+    # write them. legacy_cash_flow_json is the JSON column used before, it is
+    # read when there is no packed data (see the migrate-cf command).
+    cash_flow_data = db.Column(db.LargeBinary)
+    # none_as_null: None is stored as SQL NULL rather than a JSON 'null'
+    legacy_cash_flow_json = db.Column('cash_flow_json', db.JSON(none_as_null=True))
 
     project_id = db.Column(
         db.String(64),
@@ -124,3 +134,58 @@ class Activity(db.Model, BaseMixin):
     # activity during which no billing is issued.
     no_billing_period = db.Column(db.Integer, default=0)
 
+    @property
+    def cash_flow_json(self) -> dict:
+        if self.cash_flow_data is not None:
+            return cash_flow_codec.decode(self.cash_flow_data)
+        return self.legacy_cash_flow_json
+
+    @cash_flow_json.setter
+    def cash_flow_json(self, cash_flow: dict):
+        data = cash_flow_codec.encode(cash_flow) if cash_flow else None
+        if data != self.cash_flow_data:
+            self.cash_flow_data = data
+        if self.legacy_cash_flow_json is not None:
+            self.legacy_cash_flow_json = None
+
+    def as_dict(self, exclude=('cash_flow_data',)):
+        return super().as_dict(exclude=exclude)
+
+    def as_listing_dict(self):
+        '''as_dict without the cashflow, used by the projects listing'''
+        return self.as_dict(exclude=('cash_flow_data', 'cash_flow_json'))
+
+
+def bump_cash_flow_version(connection, project_ids):
+    '''
+    Invalidates the cashflow snapshot of the projects (see Project). The
+    project timestamps are kept, this is not an edit of the project.
+    '''
+    table = Project.__table__
+    connection.execute(
+        update(table)
+        .where(table.c.id.in_(project_ids))
+        .values(
+            cash_flow_version=db.func.coalesce(table.c.cash_flow_version, 0) + 1,
+            updated_at=table.c.updated_at,
+            timestamp=table.c.timestamp,
+            )
+        )
+
+
+@event.listens_for(Activity, 'after_insert')
+@event.listens_for(Activity, 'after_delete')
+def activity_added_or_removed(mapper, connection, activity: Activity):
+    bump_cash_flow_version(connection, [activity.project_id])
+
+
+@event.listens_for(Activity, 'after_update')
+def activity_updated(mapper, connection, activity: Activity):
+    state = inspect(activity)
+    histories = [state.attrs[key].history
+        for key in ('cash_flow_data', 'legacy_cash_flow_json', 'is_deleted',
+            'project_id')]
+    if any(history.has_changes() for history in histories):
+        bump_cash_flow_version(
+            connection,
+            [activity.project_id, *state.attrs.project_id.history.deleted])
@@ -57,8 +57,11 @@ class BaseMixin:
         db.session.delete(self)
         db.session.commit()
 
-    def as_dict(self):
-        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+    def as_dict(self, exclude=()):
+        return {
+            c.name: getattr(self, c.name) for c in self.__table__.columns
+            if c.name not in exclude
+            }
 
     def __str__(self):
         return str(self.as_dict())
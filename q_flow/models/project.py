@@ -1,9 +1,16 @@
 '''
 Project Model
 '''
+from datetime import date, datetime
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import validates
+from sqlalchemy.orm.attributes import flag_modified
+from q_flow.exceptions import InvalidData
 from q_flow.extensions import db
 from q_flow.services.utils import rnd_color
 from q_flow.models.mixins import BaseMixin
+from q_flow.series import Series, as_json as series_json
+from q_flow.timeline import add_months, month_start, rebucket
 
 
 class Project(db.Model, BaseMixin):
@@ -23,24 +30,148 @@ class Project(db.Model, BaseMixin):
     contract_value = db.Column(db.Float, default=0)
     wieb = db.Column(db.Float, default=0.2)
 
-    def as_dict_with_activities(self):
+    # month 0 of the project cashflow (see timeline.py), the month the project
+    # was created if not set
+    start_date = db.Column(db.Date)
+
+    # Running sum of the cashflows of the not deleted activities, maintained
+    # by Project_cf.update_activity (see cashflow.py)
+    cash_flow_json = db.Column(db.JSON)
+
+    # The computed inflow, outflow, factored work and analytics of the
+    # project. The snapshot is valid while its version is the
+    # cash_flow_version of the project, which is incremented when the
+    # contract terms or the activities of the project change (see the
+    # invalidate_cash_flow listeners).
+    cash_flow_version = db.Column(db.Integer, default=0)
+    cash_flow_snapshot = db.Column(db.JSON)
+
+    # format of the snapshot: 2 stores the inflow and outflow as sparse series
+    # (see series.py)
+    SNAPSHOT_FORMAT = 2
+
+    # contract terms used to compute the project cashflow
+    CASH_FLOW_TERMS = (
+        'advance', 'retention', 'release_retention_eop', 'dlp',
+        'duration_for_payment', 'interest_rate', 'contract_value', 'wieb',
+        )
+
+    @validates('start_date')
+    def validate_start_date(self, key, value):
+        if isinstance(value, str):
+            if not value:
+                return None
+            try:
+                return date.fromisoformat(value[:10])
+            except ValueError:
+                raise InvalidData(f'Invalid start_date: {value}')
+        return value
+
+    @property
+    def start_month(self):
+        '''The first day of the month 0 of the project cashflow'''
+        return month_start(self.start_date or self.created_at or datetime.now())
+
+    def as_dict(self, exclude=('cash_flow_json', 'cash_flow_snapshot')):
+        return super().as_dict(exclude=exclude)
+
+    @staticmethod
+    def valid_snapshot(snapshot: dict, version: int) -> bool:
+        '''
+        True if the snapshot is the cashflow of the given cash_flow_version.
+        Snapshots stored in an older format are not valid.
+        '''
+        return (bool(snapshot) and snapshot.get('version') == version
+            and snapshot.get('format') == Project.SNAPSHOT_FORMAT)
+
+    def cash_flow(self) -> dict:
+        '''
+        Returns the cashflow snapshot of the project computing (and committing)
+        it only if the stored one is not valid anymore.
+        '''
         from q_flow.cashflow import Project_cf
-        activities = self.activities
-        if activities:
-            cashflow = Project_cf(self)
-            inflow = cashflow.inflow()
-            outflow = cashflow.outflow()
+        snapshot = self.cash_flow_snapshot
+        if self.valid_snapshot(snapshot, self.cash_flow_version):
+            return snapshot
+        snapshot = Project_cf(self).as_json()
+        snapshot['version'] = self.cash_flow_version
+        self.cash_flow_snapshot = snapshot
+        self.commit_cash_flow()
+        return snapshot
+
+    def commit_cash_flow(self):
+        '''
+        Commits the cashflow columns. updated_at is kept as is so recomputing
+        the cashflow does not change the order of the projects list.
+        '''
+        flag_modified(self, 'updated_at')
+        return self.commit()
+
+    @staticmethod
+    def _dated_activity(activity: dict, start: date) -> dict:
+        activity['start_date'] = add_months(start, activity.get('start') or 0).isoformat()
+        return activity
+
+    def cash_flow_as_dict(self, cash_flow: dict = None, freq='month', series='dense') -> dict:
+        '''
+        The inflow, outflow and analytics of a cashflow snapshot (None for a
+        project without activities) for the API.
+        freq: the inflow and outflow are summed by week, month or quarter.
+        dates are the first days of the periods, each series covers the first
+        dates.
+        series: "dense" for lists, "sparse" for the sparse form of series.py
+        without the dates (the periods from start_month)
+        '''
+        if cash_flow:
+            inflow = Series.from_json(cash_flow['inflow']).to_dense()
+            outflow = Series.from_json(cash_flow['outflow']).to_dense()
+            analytics = cash_flow['analytics']
         else:
             inflow = [0.0]
             outflow = [0.0]
-        as_dict = super().as_dict()
-        as_dict.update(
-            {
-                'activities': [a.as_dict() for a in activities if not a.is_deleted],
-                'inflow': inflow,
-                'outflow': outflow,
-                }
-            )
+            analytics = None
+        start = self.start_month
+        inflow_dates, inflow = rebucket(inflow, start, freq)
+        outflow_dates, outflow = rebucket(outflow, start, freq)
+        as_dict = {
+            'start_month': start.isoformat(),
+            'freq': freq,
+            'inflow': series_json(inflow, series),
+            'outflow': series_json(outflow, series),
+            'analytics': analytics,
+            }
+        if series == 'dense':
+            as_dict['dates'] = max(inflow_dates, outflow_dates, key=len)
         return as_dict
-    
 
+    def as_dict_with_activities(self, listing=False, freq='month', series='dense'):
+        '''
+        listing: the activities are listed without their cashflow (see
+        Activity.as_listing_dict)
+        freq, series: see cash_flow_as_dict
+        '''
+        activities = [a for a in self.activities if not a.is_deleted]
+        start = self.start_month
+        as_dict = self.as_dict()
+        as_dict['activities'] = [
+            self._dated_activity(
+                a.as_listing_dict() if listing else a.as_dict(), start)
+            for a in activities]
+        # a project without cost has no cashflow (see Project_cf)
+        as_dict.update(self.cash_flow_as_dict(
+            self.cash_flow() if any(a.cost for a in activities) else None,
+            freq, series))
+        return as_dict
+
+
+
+@event.listens_for(Project, 'before_update')
+def invalidate_cash_flow(mapper, connection, project: Project):
+    '''
+    Invalidates the cashflow snapshot when the contract terms change. The
+    version is incremented in SQL like the other writers of the version (a
+    concurrent bump is not overwritten by the loaded value + 1).
+    '''
+    state = inspect(project)
+    if any(state.attrs[term].history.has_changes() for term in Project.CASH_FLOW_TERMS):
+        project.cash_flow_version = db.func.coalesce(Project.cash_flow_version, 0) + 1
@@ -0,0 +1,173 @@
+'''
+Validated cashflow parameters of activities and projects.
+
+The parameters are read from the model (or from a model overlay, see
+scenario.py) once, cast to the type of their field and checked when the
+object is built, so the cashflow computations (engine.py, curves.py,
+simulation.py, sensitivity.py) do not check them again. Invalid parameters
+raise InvalidData (400). The fields not set on the model (None) take the
+default of their column.
+'''
+from dataclasses import asdict, dataclass, fields
+from functools import lru_cache
+from math import isfinite
+
+from q_flow.exceptions import InvalidData
+
+
+def _fraction(value) -> bool:
+    return 0 <= value <= 1
+
+
+def _non_negative(value) -> bool:
+    return value >= 0
+
+
+FRACTION = (_fraction, 'must be between 0 and 1')
+NON_NEGATIVE = (_non_negative, 'must not be negative')
+
+
+@lru_cache(maxsize=None)
+def _defaults(table) -> dict:
+    return {
+        c.name: c.default.arg for c in table.columns
+        if c.default is not None and c.default.is_scalar}
+
+
+def _values(obj, names, changes: dict) -> dict:
+    '''
+    The values of the fields of obj (a model or an overlay) with the changes
+    applied. None values are replaced by the column defaults.
+    '''
+    defaults = _defaults(obj.__table__)
+    values = {}
+    for name in names:
+        value = changes[name] if name in changes else getattr(obj, name)
+        values[name] = defaults.get(name) if value is None else value
+    return values
+
+
+def cast(name, kind, value):
+    '''
+    Casts a value of the field name to its type (float, int, bool or str),
+    raises InvalidData if the value is not of the type: floats are finite,
+    ints are integral, bools are true/false (or 1/0), strs are strings.
+    '''
+    if kind is bool:
+        if isinstance(value, str) and value.lower() in ('true', 'false'):
+            return value.lower() == 'true'
+        InvalidData.require_condition(
+            isinstance(value, (bool, int, float)) and value in (True, False),
+            f'{name} must be true or false')
+        return bool(value)
+    if kind is str:
+        InvalidData.require_condition(isinstance(value, str), f'{name} must be a string')
+        return value
+    try:
+        cast = kind(value)
+    except (TypeError, ValueError, OverflowError):
+        raise InvalidData(f'Invalid value for {name}: {value}')
+    if kind is float:
+        InvalidData.require_condition(isfinite(cast), f'{name} must be a finite number')
+    elif cast != float(value):
+        raise InvalidData(f'{name} must be an integer')
+    return cast
+
+
+def _validate(params, rules: dict) -> None:
+    '''
+    Casts the fields of a (frozen) params object and checks their rules
+    '''
+    for field in fields(params):
+        value = cast(field.name, field.type, getattr(params, field.name))
+        object.__setattr__(params, field.name, value)
+        check, message = rules.get(field.name, (None, None))
+        InvalidData.require_condition(
+            check is None or check(value), f'{field.name} {message}')
+
+
+@dataclass(frozen=True, slots=True)
+class ActivityParams:
+    duration: int
+    skew: float
+    cost: float
+    start: int
+    mobilization_period: int
+    no_billing_period: int
+    subcontracted: float
+    work_in_excess: float
+    retention: float
+    advance: float
+    duration_for_payment: int
+    dlp: int
+    release_retention_eop: float
+    linear: bool = False
+
+    RULES = {
+        'duration': (lambda d: d >= 1, 'must be at least 1'),
+        'skew': (lambda s: -1 < s < 1, 'must be between -1 and 1 (excluded)'),
+        'cost': NON_NEGATIVE,
+        'start': NON_NEGATIVE,
+        'mobilization_period': NON_NEGATIVE,
+        'no_billing_period': NON_NEGATIVE,
+        'subcontracted': FRACTION,
+        'work_in_excess': FRACTION,
+        'retention': FRACTION,
+        'advance': FRACTION,
+        'duration_for_payment': NON_NEGATIVE,
+        'dlp': NON_NEGATIVE,
+        'release_retention_eop': FRACTION,
+    }
+
+    def __post_init__(self) -> None:
+        _validate(self, self.RULES)
+
+    @classmethod
+    def of(cls, activity, **changes) -> 'ActivityParams':
+        '''
+        The parameters of an activity, changes are the fields about to be
+        updated (e.g. the data of a request)
+        '''
+        names = [f.name for f in fields(cls) if f.name != 'linear']
+        activity_type = changes.get('activity_type', activity.activity_type)
+        return cls(**_values(activity, names, changes), linear=activity_type == 'linear')
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass(frozen=True, slots=True)
+class ProjectParams:
+    advance: float
+    retention: float
+    release_retention_eop: float
+    dlp: int
+    duration_for_payment: int
+    interest_rate: float
+    contract_value: float
+    wieb: float
+
+    RULES = {
+        'advance': FRACTION,
+        'retention': FRACTION,
+        'release_retention_eop': FRACTION,
+        'dlp': NON_NEGATIVE,
+        'duration_for_payment': NON_NEGATIVE,
+        'interest_rate': (lambda r: r > -1, 'must be greater than -1'),
+        'contract_value': NON_NEGATIVE,
+        'wieb': FRACTION,
+    }
+
+    def __post_init__(self) -> None:
+        _validate(self, self.RULES)
+
+    @classmethod
+    def of(cls, project, **changes) -> 'ProjectParams':
+        '''
+        The contract terms of a project, changes are the fields about to be
+        updated
+        '''
+        return cls(**_values(project, [f.name for f in fields(cls)], changes))
+
+    def as_dict(self) -> dict:
+        return asdict(self)
@@ -0,0 +1,120 @@
+'''
+Portfolio cashflow: the inflow, outflow and net position of all the not
+deleted projects of a user on a common monthly calendar.
+
+The projects are streamed: only the id, the start month, the version and the
+cashflow snapshot of each project are read (in batches) and the snapshot is
+added to the running totals at the month offset of the project. The projects
+whose snapshot is not valid anymore are loaded and recomputed one at a time
+after the stream (see Project.cash_flow).
+
+Month 0 of the calendar is the month of the earliest project start (see
+Project.start_month), adding a project is an offset-and-add. The totals can
+be re-bucketed by week, month or quarter (see timeline.py).
+'''
+from datetime import date
+
+import numpy as np
+from sqlalchemy import func
+
+from q_flow.extensions import db
+from q_flow.models.project import Project
+from q_flow.series import Series, as_json as series_json
+from q_flow.timeline import month_offset, month_start, rebucket
+
+
+class Portfolio_cf():
+    '''
+    Running sum of project cashflows placed on a common calendar
+    '''
+    def __init__(self, start: date = None) -> None:
+        self.start = start
+        self.projects = 0
+        self.recomputed = 0
+        self._inflow = np.zeros(64)
+        self._outflow = np.zeros(64)
+        self.length = 0
+
+    def _grow(self, length: int) -> None:
+        # amortized growth: the capacity is doubled when it is exceeded
+        if length > len(self._inflow):
+            capacity = max(length, 2 * len(self._inflow))
+            self._inflow = np.resize(self._inflow, capacity)
+            self._outflow = np.resize(self._outflow, capacity)
+            self._inflow[self.length:] = 0
+            self._outflow[self.length:] = 0
+        self.length = max(self.length, length)
+
+    def add(self, snapshot: dict, offset: int = 0) -> None:
+        '''
+        Adds the cashflow snapshot of a project starting at month offset
+        '''
+        inflow = Series.from_json(snapshot['inflow'])
+        outflow = Series.from_json(snapshot['outflow'])
+        self._grow(offset + max(len(inflow), len(outflow)))
+        inflow.add_to(self._inflow, offset)
+        outflow.add_to(self._outflow, offset)
+        self.projects += 1
+
+    @property
+    def inflow(self) -> np.ndarray:
+        return self._inflow[:self.length]
+
+    @property
+    def outflow(self) -> np.ndarray:
+        return self._outflow[:self.length]
+
+    @classmethod
+    def for_user(cls, user_id, batch_size: int = 50) -> 'Portfolio_cf':
+        '''
+        Streams the not deleted projects of the user into a portfolio
+        '''
+        filters = (Project.created_by == user_id, Project.is_deleted == False)
+        # projects without a start date start the month they were created
+        starts = [
+            db.session.query(func.min(Project.start_date)).filter(*filters).scalar(),
+            db.session.query(func.min(Project.created_at)).filter(
+                *filters, Project.start_date.is_(None)).scalar(),
+            ]
+        starts = [month_start(s) for s in starts if s is not None]
+        portfolio = cls(min(starts) if starts else None)
+        if portfolio.start is None:
+            return portfolio
+
+        stale = []
+        rows = db.session.query(
+            Project.id, Project.start_date, Project.created_at,
+            Project.cash_flow_version, Project.cash_flow_snapshot,
+            ).filter(*filters).execution_options(yield_per=batch_size)
+        for project_id, start_date, created_at, version, snapshot in rows:
+            if Project.valid_snapshot(snapshot, version):
+                portfolio.add(snapshot, month_offset(portfolio.start, start_date or created_at))
+            else:
+                stale.append(project_id)
+
+        for project_id in stale:
+            project = db.session.get(Project, project_id)
+            if any(a.cost for a in project.activities if not a.is_deleted):
+                portfolio.add(
+                    project.cash_flow(), month_offset(portfolio.start, project.start_month))
+                portfolio.recomputed += 1
+        return portfolio
+
+    def as_json(self, freq: str = 'month', series: str = 'dense') -> dict:
+        start = self.start or date.today()
+        dates, inflow = rebucket(self.inflow, start, freq)
+        outflow = rebucket(self.outflow, start, freq)[1]
+        net = inflow - outflow
+        as_json = {
+            'start': self.start.isoformat() if self.start else None,
+            'freq': freq,
+            'projects': self.projects,
+            'recomputed': self.recomputed,
+            'inflow': series_json(inflow, series),
+            'outflow': series_json(outflow, series),
+            'net': series_json(net, series),
+            'cumulative_net': np.cumsum(net).tolist(),
+        }
+        if series == 'dense':
+            as_json['dates'] = dates
+        return as_json
@@ -0,0 +1,149 @@
+'''
+Bulk recompute of the activities cashflows, e.g. after a change of the
+cashflow engine or of the default skew of an activity type.
+
+The activities are read in batches (their cashflow parameters only) and the
+cashflows of a batch are computed by engine.py, split over a process pool
+(processes > 1). Each batch is written in one transaction: one executemany
+UPDATE of the packed cashflows (cash_flow_data) and one UPDATE of the
+projects of the batch whose stored aggregate and snapshot are invalidated,
+they are rebuilt from the activities when the projects are next read (see
+Project_cf.rebuild). The activities and projects timestamps are kept, a
+recompute is not an edit.
+'''
+from concurrent.futures import ProcessPoolExecutor
+from logging import getLogger
+
+from sqlalchemy import bindparam, null, update
+from sqlalchemy.orm import load_only
+
+from q_flow.cashflow import Activity_cf
+from q_flow.engine import ActivityCashFlow
+from q_flow.exceptions import InvalidData
+from q_flow.extensions import db
+from q_flow.models.activity import Activity, ActivityType
+from q_flow.models.project import Project
+from q_flow.params import ActivityParams
+from q_flow.services import cash_flow_codec
+
+DEFAULT_BATCH_SIZE = 1000
+
+log = getLogger(__name__)
+
+
+def encode_chunk(params: list) -> list:
+    '''
+    Computes and packs the cashflows of a list of ActivityParams. Runs in the
+    worker processes.
+    '''
+    return [
+        cash_flow_codec.encode(cash_flow.as_json())
+        for cash_flow in ActivityCashFlow.batch(params)]
+
+
+def activity_filters(project_ids=None, activity_type=None, user_id=None,
+        missing=False) -> list:
+    '''
+    Filters of the activities to recompute, the deleted activities are not
+    recomputed
+    '''
+    filters = [Activity.is_deleted.isnot(True)]
+    if project_ids:
+        filters.append(Activity.project_id.in_(project_ids))
+    if activity_type:
+        filters.append(Activity.activity_type == activity_type)
+    if user_id:
+        filters.append(Activity.created_by == user_id)
+    if missing:
+        filters.append(Activity.cash_flow_data.is_(None))
+    return filters
+
+
+def write_batch(rows: list, project_ids: set) -> None:
+    '''
+    Stores the packed cashflows (and skews) of a batch and invalidates the
+    cashflow of their projects
+    '''
+    activity = Activity.__table__
+    db.session.execute(
+        update(activity)
+        .where(activity.c.id == bindparam('_id'))
+        .values(
+            cash_flow_data=bindparam('_data'),
+            skew=bindparam('_skew'),
+            updated_at=activity.c.updated_at,
+            timestamp=activity.c.timestamp,
+            ),
+        rows)
+    project = Project.__table__
+    db.session.execute(
+        update(project)
+        .where(project.c.id.in_(project_ids))
+        .values(
+            cash_flow_json=null(),
+            cash_flow_version=db.func.coalesce(project.c.cash_flow_version, 0) + 1,
+            updated_at=project.c.updated_at,
+            timestamp=project.c.timestamp,
+            ))
+    db.session.commit()
+
+
+def recompute(filters: list, processes: int = 1, batch_size: int = DEFAULT_BATCH_SIZE,
+        reset_skew=False, progress=None) -> int:
+    '''
+    Recomputes the cashflows of the activities matching the filters and
+    returns their number. Activities with invalid parameters are skipped
+    (and logged).
+    reset_skew: the skew of the activities is set to the default skew of
+    their activity type before the cashflow is computed.
+    progress: called with (done, total) after each batch.
+    '''
+    columns = [getattr(Activity, c) for c in ('id', 'project_id') + Activity_cf.PARAMETERS]
+    query = Activity.query.options(load_only(*columns)).filter(*filters)
+    total = query.count()
+    done, skipped, last_id = 0, 0, None
+    pool = ProcessPoolExecutor(max_workers=processes) if processes > 1 else None
+    try:
+        while True:
+            batch = query.order_by(Activity.id)
+            if last_id is not None:
+                batch = batch.filter(Activity.id > last_id)
+            activities = batch.limit(batch_size).all()
+            if not activities:
+                break
+            last_id = activities[-1].id
+
+            valid, params = [], []
+            for activity in activities:
+                skew = (ActivityType.skew_by_code(activity.activity_type)
+                    if reset_skew else activity.skew)
+                try:
+                    params.append(ActivityParams.of(activity, skew=skew))
+                except InvalidData as e:
+                    log.warning(f'activity {activity.id} not recomputed: {e}')
+                    continue
+                valid.append((activity, skew))
+
+            if pool is None:
+                data = encode_chunk(params) if params else []
+            else:
+                size = -(-len(params) // processes)
+                chunks = [params[i:i + size] for i in range(0, len(params), size)]
+                data = [d for chunk in pool.map(encode_chunk, chunks) for d in chunk]
+            if valid:
+                write_batch(
+                    [{'_id': a.id, '_data': d, '_skew': skew}
+                        for (a, skew), d in zip(valid, data)],
+                    {a.project_id for a, _ in valid})
+
+            # the session keeps no activity between the batches (the objects
+            # of the session are detached)
+            db.session.expunge_all()
+            done += len(valid)
+            skipped += len(activities) - len(valid)
+            if progress:
+                progress(done + skipped, total)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return done
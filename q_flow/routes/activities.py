@@ -1,9 +1,10 @@
 from os import path
 from flask import Blueprint, current_app, jsonify, request, json
-from q_flow.cashflow import Activity_cf
+from q_flow.cashflow import Activity_cf, Project_cf
 from q_flow.exceptions import MissingData, PermissionDenied, ProjectNotFound
 from q_flow.models.activity import Activity, ActivityType
 from q_flow.models.project import Project
+from q_flow.params import ActivityParams
 from q_flow.services.decorators import auth_required
 from q_flow.services.utils import check_required, read_data
 from logging import getLogger
@@ -12,6 +13,17 @@ activities = Blueprint('activities', __name__)
 log = getLogger(__name__)
 
 
+def restore(activity: Activity):
+    '''Restores a deleted activity and adds it back to the project cashflow'''
+    was_deleted = activity.is_deleted
+    activity.is_deleted = False
+    activity.commit()
+    if was_deleted:
+        if not activity.cash_flow_json:
+            Activity_cf(activity).set_cashflow()
+        Project_cf.update_activity(activity.project, new=activity.cash_flow_json)
+
+
 @activities.route('/activities', methods=['GET'])
 def get_activities():
     return jsonify({'data': 'activities', 'message': 'test for roger'}), 200
@@ -35,10 +47,13 @@ def new_activity(user, project_id):
     MissingData.require_condition(
         data.get('name') and data.get("cost"), 'Missing name or cost')
     ProjectNotFound.require_condition(Project.Identify(project_id), 'Project not found')
-    activity.from_dict(data, user.get('user_id')).commit()
+    activity.from_dict(data, user.get('user_id'))
     if activity.skew == 0 or activity.skew == None:
         activity.skew = ActivityType.skew_by_code(activity.activity_type)
+    ActivityParams.of(activity)
+    activity.commit()
     Activity_cf(activity).set_cashflow()
+    Project_cf.update_activity(activity.project, new=activity.cash_flow_json)
     return jsonify(data=activity.as_dict(), message='Activity created successfully'), 201
 
 @activities.route('/activity/<activity_id>', methods=['GET'])
@@ -63,11 +78,27 @@ def update_activity(user, activity_id):
         activity and not activity.is_deleted, 'Activity not found')
     PermissionDenied.require_condition(
         activity.project.created_by == user.get('user_id'), f'Permission denied for user {user.get("name")}')
+    project_id = data.get('project_id') or activity.project_id
+    if project_id != activity.project_id:
+        # the activity is moved to another project of the user
+        project = Project.query.get(project_id)
+        ProjectNotFound.require_condition(
+            project and not project.is_deleted, 'Project not found')
+        PermissionDenied.require_condition(
+            project.created_by == user.get('user_id'), f'Permission denied for user {user.get("name")}')
+    ActivityParams.of(activity, **data)
+    old_project, old_cash_flow = activity.project, activity.cash_flow_json
     activity.update(user.get('id'), **data)
     if activity.skew == 0 or activity.skew == None:
         activity.skew = ActivityType.skew_by_code(activity.activity_type)
     Activity_cf(activity).set_cashflow()
     activity.commit()
+    if activity.project_id == old_project.id:
+        Project_cf.update_activity(
+            old_project, old=old_cash_flow, new=activity.cash_flow_json)
+    else:
+        Project_cf.update_activity(old_project, old=old_cash_flow)
+        Project_cf.update_activity(activity.project, new=activity.cash_flow_json)
     return jsonify(data=activity.as_dict(), message='Activity updated successfully'), 200
 
 @activities.route('/delete_activity/<activity_id>', methods=['DELETE'])
@@ -80,6 +111,7 @@ def delete_activity(user, activity_id):
     PermissionDenied.require_condition(
         activity.project.created_by == user.get('user_id'), f'Permission denied for user {user.get("name")}')
     activity.delete()
+    Project_cf.update_activity(activity.project, old=activity.cash_flow_json)
     return jsonify(message='Activity deleted successfully'), 200
 
 @activities.route('/hard_delete_activity/<activity_id>', methods=['DELETE'])
@@ -90,7 +122,11 @@ def hard_delete_activity(user, activity_id):
     PermissionDenied.require_condition(activity, 'Activity not found')
     PermissionDenied.require_condition(
         activity.project.created_by == user.get('user_id'), f'Permission denied for user {user.get("name")}')
+    project, old_cash_flow = activity.project, activity.cash_flow_json
+    was_deleted = activity.is_deleted
     activity.hard_delete()
+    if not was_deleted:
+        Project_cf.update_activity(project, old=old_cash_flow)
     return jsonify(message='Activity hard deleted successfully'), 200
 
 @activities.route('/restore_activity/<activity_id>', methods=['PUT'])
@@ -101,8 +137,7 @@ def restore_activity(user, activity_id):
     PermissionDenied.require_condition(activity, 'Activity not found')
     PermissionDenied.require_condition(
         activity.created_by == user.get('user_id'), f'Permission denied for user {user.get("name")}')
-    activity.is_deleted = False
-    activity.commit()
+    restore(activity)
     return jsonify(message='Activity restored successfully'), 200
 
 @activities.route('/restore_activities', methods=['PUT'])
@@ -116,8 +151,7 @@ def restore_activities(user):
     for activity in activities:
         if activity.created_by != user.get('user_id'):
             continue
-        activity.is_deleted = False
-        activity.commit()
+        restore(activity)
     return jsonify(message='Activities restored successfully'), 200
 
 
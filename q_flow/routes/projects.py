@@ -1,11 +1,17 @@
 import logging
 import os
-from flask import Blueprint, jsonify, request, send_file
+from flask import Blueprint, current_app, jsonify, request, send_file
+from sqlalchemy.orm import defer, selectinload
 from werkzeug.datastructures import FileStorage
-from q_flow.exceptions import MissingData, PermissionDenied, ProjectNotDeleted, ProjectNotFound
+from q_flow.exceptions import InvalidData, MissingData, PermissionDenied, ProjectNotDeleted, ProjectNotFound
+from q_flow.models.activity import Activity
 from q_flow.models.project import Project
+from q_flow import scenario, sensitivity
+from q_flow.params import ProjectParams
+from q_flow.portfolio import Portfolio_cf
 from q_flow.services.decorators import auth_required
 from q_flow.services.utils import read_data, rnd_color
+from q_flow.simulation import simulate
 from q_flow.extensions import fs
 
 projects = Blueprint('projects', __name__)
@@ -26,10 +32,27 @@ def get_projects(user):
     data = read_data(request)
     page = data.get('page', 1, int)
     per_page = data.get('per_page', 10, int)
+    # load the activities of the page in one query, skipping the deleted
+    # ones and the cashflow columns which are served from the snapshot
     projects = Project.query.filter_by(created_by=user.get('user_id'), is_deleted=False
+        ).options(
+            defer(Project.cash_flow_json),
+            selectinload(Project.activities.and_(Activity.is_deleted == False)
+                ).defer(Activity.cash_flow_data).defer(Activity.legacy_cash_flow_json),
         ).order_by(Project.updated_at.desc()
         ).paginate(page=page, per_page=per_page, error_out=False)
-    return jsonify(data=[p.as_dict_with_activities() for p in projects.items], pages=projects.pages ), 200
+    freq = data.get('freq', 'month')
+    series = data.get('series', 'dense')
+    return jsonify(data=[p.as_dict_with_activities(listing=True, freq=freq, series=series) for p in projects.items], pages=projects.pages ), 200
+
+@projects.route('/portfolio')
+@auth_required
+def get_portfolio(user):
+    log.info(f'User {user.get("name")} requested the portfolio cashflow')
+    freq = request.args.get('freq', 'month')
+    series = request.args.get('series', 'dense')
+    portfolio = Portfolio_cf.for_user(user.get('user_id'))
+    return jsonify(data=portfolio.as_json(freq, series)), 200
 
 @projects.route('/new_project', methods=['POST'])
 @auth_required
@@ -39,6 +62,7 @@ def new_project(user):
     photo: FileStorage = request.files.get('photo')
     MissingData.require_condition(data.get('name'), 'Missing name')
     project = Project().from_dict(data, user.get('user_id'))
+    ProjectParams.of(project)
     project.photo = fs.save_project_photo(photo, project)
     project.color = rnd_color()
     project.commit()
@@ -54,7 +78,54 @@ def get_project(user, project_id):
     ProjectNotFound.require_condition(project and not project.is_deleted, 'Project not found')
     PermissionDenied.require_condition(
         project.created_by == user.get('user_id'), f'Permission denied for user {user.get("name")}')
-    return jsonify(data=project.as_dict_with_activities()), 200
+    freq = request.args.get('freq', 'month')
+    series = request.args.get('series', 'dense')
+    return jsonify(data=project.as_dict_with_activities(freq=freq, series=series)), 200
+
+@projects.route('/project/<project_id>/simulation', methods=['POST'])
+@auth_required
+def simulate_project(user, project_id):
+    log.info(f'User {user.get("name")} requested a simulation of project {project_id}')
+    project: Project = Project.query.get(project_id)
+    ProjectNotFound.require_condition(project and not project.is_deleted, 'Project not found')
+    PermissionDenied.require_condition(
+        project.created_by == user.get('user_id'), f'Permission denied for user {user.get("name")}')
+    config = dict(read_data(request) or {})
+    config['max_iterations'] = current_app.config['SIMULATION_MAX_ITERATIONS']
+    config['processes'] = current_app.config['SIMULATION_PROCESSES']
+    return jsonify(data=simulate(project, config=config)), 200
+
+@projects.route('/project/<project_id>/scenario', methods=['POST'])
+@auth_required
+def project_scenario(user, project_id):
+    log.info(f'User {user.get("name")} requested a scenario of project {project_id}')
+    project: Project = Project.query.get(project_id)
+    ProjectNotFound.require_condition(project and not project.is_deleted, 'Project not found')
+    PermissionDenied.require_condition(
+        project.created_by == user.get('user_id'), f'Permission denied for user {user.get("name")}')
+    data = read_data(request) or {}
+    project_cf, recomputed = scenario.run(project, data)
+    as_dict = project.cash_flow_as_dict(
+        project_cf.as_json(), data.get('freq', 'month'), data.get('series', 'dense'))
+    as_dict['recomputed'] = recomputed
+    return jsonify(data=as_dict), 200
+
+@projects.route('/project/<project_id>/sensitivity', methods=['POST'])
+@auth_required
+def project_sensitivity(user, project_id):
+    log.info(f'User {user.get("name")} requested a sensitivity grid of project {project_id}')
+    project: Project = Project.query.get(project_id)
+    ProjectNotFound.require_condition(project and not project.is_deleted, 'Project not found')
+    PermissionDenied.require_condition(
+        project.created_by == user.get('user_id'), f'Permission denied for user {user.get("name")}')
+    grid = (read_data(request) or {}).get('grid') or {}
+    points = 1
+    for values in grid.values():
+        points *= len(values) if isinstance(values, list) else 1
+    InvalidData.require_condition(
+        points <= current_app.config['SENSITIVITY_MAX_POINTS'],
+        f'Maximum {current_app.config["SENSITIVITY_MAX_POINTS"]} grid points')
+    return jsonify(data=sensitivity.sweep(project, grid)), 200
 
 @projects.route('/delete_project/<project_id>', methods=['DELETE'])
 @auth_required
@@ -87,6 +158,7 @@ def update_project(user, project_id):
     PermissionDenied.require_condition(
         project.created_by == user.get('user_id'), f'Permission denied for user {user.get("name")}')
     data = read_data(request)
+    ProjectParams.of(project, **data)
     project.update(user.get("id"), **data)
     project.photo = fs.save_project_photo(request.files.get('photo'), project)
     return jsonify(data=project.as_dict_with_activities(), message='Project updated successfully'), 200
@@ -1,12 +1,9 @@
 from logging import getLogger
 from flask import Blueprint, current_app, jsonify, request
-from google.auth.transport import requests as g_requests
-from google.oauth2 import id_token
-import requests
 from q_flow.exceptions import InvalidCredentials
 from q_flow.services.decorators import auth_required
 from q_flow.services.user_api import U_Api_resp
-from q_flow.extensions import u_api
+from q_flow.extensions import au_api, g_auth, u_api
 from q_flow.services.utils import read_data
 
 users = Blueprint('users', __name__)
@@ -37,12 +34,12 @@ def get_user_by_token():
         )), 200
 
 @users.route('/login', methods=['POST'])
-def login():
+async def login():
     data = read_data(request)
     email = data.get('email')
     password = data.get('password')
     log.info(f"User {email} requested to login")
-    resp: U_Api_resp = u_api.post('login', data=dict(email=email, password=password))
+    resp: U_Api_resp = await au_api.post('login', data=dict(email=email, password=password))
     if resp.error:
         log.info(f"User {email} login failed")
         return jsonify(
@@ -51,7 +48,7 @@ def login():
                 message=resp.message,
             )), resp.status_code
     token = resp.response.json().get('data').get('token')
-    user = u_api.verify_token(token)
+    user = await au_api.verify_token(token)
     return jsonify(
         dict(
             message='Login successful',
@@ -59,12 +56,12 @@ def login():
         )), 200
 
 @users.route('/register', methods=['POST'])
-def register():
+async def register():
     data = read_data(request)
     email = data.get('email')
     password = data.get('password')
     log.info(f"User {email} requested to register")
-    resp: U_Api_resp = u_api.post(
+    resp: U_Api_resp = await au_api.post(
         'register', data=dict(email=email, password=password))
     if resp.error:
         log.info(f"User {email} registration failed")
@@ -180,7 +177,7 @@ def deactivate_account(user):
         )), resp.status_code
 
 @users.route('/google_login', methods=['PUT'])
-def google_login():
+async def google_login():
     log.info("User requested to login with google")
     data = read_data(request)
     client_platform = data.get('platform')
@@ -192,12 +189,9 @@ def google_login():
     log.info(f"user trying to login with google on {client_platform}")
     try:
         if idToken:
-            id_info = id_token.verify_oauth2_token(
-                idToken, g_requests.Request(), audience=audience, clock_skew_in_seconds=1)
+            id_info = await au_api.to_thread(g_auth.verify_id_token, idToken, audience=audience)
         elif access_token:
-            id_info = requests.get(
-                f"https://www.googleapis.com/oauth2/v3/userinfo?access_token={access_token}"
-            ).json()
+            id_info = await au_api.to_thread(g_auth.userinfo, access_token)
         else:
             return jsonify(dict(error='Invalid token', message='No token provided')), 400
         InvalidCredentials.require_condition(
@@ -210,14 +204,14 @@ def google_login():
     except ValueError as e:
         return jsonify(dict(error='Invalid token', message=str(e))), 400
 
-    resp =  u_api.post(
+    resp = await au_api.post(
         'oauth_login', 
         data={'oauth':'google', 'verify_email': False,  'user_info': user_info}
         )
     if resp.error:
         return jsonify(dict(error=resp.error, message=resp.message)), resp.status_code
     token = resp.response.json().get('data').get('token')
-    user = u_api.verify_token(token)
+    user = await au_api.verify_token(token)
     log.info(f"User {user.get('name')} logged in with google")
     return jsonify(
         dict(message=resp.message,
@@ -0,0 +1,137 @@
+'''
+What-if scenarios: the cashflow of a project with some of its contract terms
+and activity fields overridden, without changing the project.
+
+The project and its activities are wrapped in copy-on-write overlays: the
+overridden fields are read from the overlay, the other fields from the
+stored objects and any write (e.g. a computed cashflow) goes to the overlay
+only. The scenario starts from the stored aggregate of the project
+(Project.cash_flow_json) and only the activities whose cashflow fields are
+overridden are recomputed, the others keep their stored cash_flow_json.
+
+overrides:
+    {
+        "project": {"advance": 0.15, "duration_for_payment": 2},
+        "activities": {"<activity id>": {"duration": 8, "is_deleted": true}}
+    }
+'''
+from q_flow.cashflow import Activity_cf, CashFlowAggregate, Project_cf
+from q_flow.exceptions import InvalidData
+from q_flow.models.activity import Activity
+from q_flow.models.project import Project
+from q_flow.params import ActivityParams, ProjectParams, cast
+
+ACTIVITY_FIELDS = Activity_cf.PARAMETERS + ('is_deleted',)
+
+
+class Overlay():
+    '''
+    Copy-on-write view of a model object
+    '''
+    def __init__(self, base, overrides: dict = None) -> None:
+        object.__setattr__(self, '_base', base)
+        object.__setattr__(self, '_overrides', dict(overrides or {}))
+
+    def __getattr__(self, name):
+        overrides = object.__getattribute__(self, '_overrides')
+        if name in overrides:
+            return overrides[name]
+        return getattr(object.__getattribute__(self, '_base'), name)
+
+    def __setattr__(self, name, value) -> None:
+        self._overrides[name] = value
+
+    def commit(self):
+        # nothing of a scenario is saved
+        return self
+
+    commit_cash_flow = commit
+
+
+class ProjectOverlay(Overlay):
+    '''
+    Overlay of a project and of its activities
+    '''
+    def __init__(self, project: Project, overrides: dict = None,
+            activity_overrides: dict = None) -> None:
+        super().__init__(project, overrides)
+        activity_overrides = activity_overrides or {}
+        activities = []
+        for activity in project.activities:
+            fields = {
+                field: value
+                for field, value in activity_overrides.get(activity.id, {}).items()
+                if getattr(activity, field) != value}
+            # the stored cashflow is not valid for the overridden fields
+            if any(f != 'is_deleted' for f in fields):
+                fields = dict(fields, cash_flow_json=None)
+            activities.append(Overlay(activity, fields))
+        self.activities = activities
+
+
+def coerce_fields(model, fields: dict, allowed: tuple, name: str) -> dict:
+    '''
+    Checks the overridden fields are cashflow fields of the model and casts
+    the values to the type of their column, as the params of the updates are
+    (see params.cast)
+    '''
+    coerced = {}
+    for field, value in (fields or {}).items():
+        InvalidData.require_condition(
+            field in allowed, f'{field} is not a cashflow field of {name}')
+        coerced[field] = cast(field, model.__table__.columns[field].type.python_type, value)
+    return coerced
+
+
+def overlay(project: Project, overrides: dict) -> ProjectOverlay:
+    '''
+    Builds the overlay of the project for the overrides
+    '''
+    overrides = overrides or {}
+    ids = {a.id for a in project.activities}
+    activity_overrides = {}
+    for activity_id, fields in (overrides.get('activities') or {}).items():
+        InvalidData.require_condition(
+            activity_id in ids, f'Activity {activity_id} not in the project')
+        activity_overrides[activity_id] = coerce_fields(
+            Activity, fields, ACTIVITY_FIELDS, 'the activity')
+    scenario = ProjectOverlay(
+        project,
+        coerce_fields(Project, overrides.get('project'), Project.CASH_FLOW_TERMS, 'the project'),
+        activity_overrides)
+    # the overridden values are checked before any computation
+    ProjectParams.of(scenario)
+    for activity in scenario.activities:
+        if activity._overrides:
+            ActivityParams.of(activity)
+    return scenario
+
+
+def run(project: Project, overrides: dict) -> tuple:
+    '''
+    Returns the Project_cf of the scenario and the number of recomputed
+    activities
+    '''
+    scenario = overlay(project, overrides)
+    changed = [a for a in scenario.activities if a._overrides]
+
+    if project.cash_flow_json is None:
+        # no stored aggregate: it is built from the overlaid activities
+        activities = [a for a in scenario.activities if not a.is_deleted]
+        InvalidData.require_condition(activities, 'The scenario has no activities')
+        recomputed = sum(1 for a in activities if not a.cash_flow_json)
+        return Project_cf(scenario), recomputed
+
+    aggregate = CashFlowAggregate(project.cash_flow_json)
+    recompute = [a for a in changed if not a.is_deleted and a.cash_flow_json is None]
+    for activity_cf in Activity_cf.batch(recompute):
+        activity_cf.activity.cash_flow_json = activity_cf.as_json()
+    for activity in changed:
+        base = activity._base
+        if not base.is_deleted:
+            aggregate.subtract(base.cash_flow_json)
+        if not activity.is_deleted:
+            aggregate.add(activity.cash_flow_json)
+    InvalidData.require_condition(aggregate.cost > 0, 'The scenario has no activities')
+    scenario.cash_flow_json = aggregate.as_json()
+    return Project_cf(scenario), len(recompute)
@@ -0,0 +1,108 @@
+'''
+Sensitivity grid: summary metrics of a project cashflow for every point of a
+grid of contract terms, e.g. advance x retention x duration_for_payment x wieb.
+
+The contract terms do not change the activities cashflows, so the outflow and
+the factored work of the project are computed once. The inflow is linear in
+the other terms: with fw the factored work, the billed work of a point is
+
+    (1 - advance - retention) * (B0 + wieb * B1)
+
+where B0 = [fw, 0] and B1 = [0, fw] - [fw, 0] are the same for all the
+points. The inflow of all the points is built as one matrix (one row per
+point), the integer terms (duration_for_payment, dlp) only shift the columns
+of the rows. The metrics of all the rows are computed in one pass of
+analytics.analyze.
+'''
+from dataclasses import replace
+from itertools import product
+
+import numpy as np
+
+from q_flow import analytics
+from q_flow.cashflow import Project_cf
+from q_flow.exceptions import InvalidData
+from q_flow.models.project import Project
+from q_flow.params import ProjectParams
+
+
+def grid_points(project: Project, grid: dict) -> dict:
+    '''
+    Returns one array per contract term with the value of the term at each
+    point of the grid (the project value for the terms not in the grid)
+    '''
+    InvalidData.require_condition(grid, 'Missing grid')
+    base = ProjectParams.of(project)
+    values = {}
+    for term, term_values in grid.items():
+        InvalidData.require_condition(
+            term in Project.CASH_FLOW_TERMS, f'{term} is not a cashflow field of the project')
+        InvalidData.require_condition(
+            isinstance(term_values, list) and term_values, f'Missing values for {term}')
+        values[term] = [
+            getattr(replace(base, **{term: value}), term) for value in term_values]
+    points = np.array(list(product(*values.values())), dtype=float).reshape(-1, len(values))
+    terms = {
+        term: np.full(len(points), value)
+        for term, value in base.as_dict().items()}
+    for i, term in enumerate(values):
+        terms[term] = points[:, i]
+    for term in ('dlp', 'duration_for_payment'):
+        terms[term] = terms[term].astype(int)
+    return terms
+
+
+def grid_inflow(work: np.ndarray, terms: dict) -> np.ndarray:
+    '''
+    The inflow of every point of the grid, one row per point, and the length
+    of the inflow of each point. work is the aggregate work of the project
+    (not factored).
+    '''
+    cv = terms['contract_value']
+    advance, retention = terms['advance'], terms['retention']
+    eop, wieb = terms['release_retention_eop'], terms['wieb']
+    dfp, dlp = terms['duration_for_payment'], terms['dlp']
+    points, n = len(cv), len(work)
+
+    unit = work / work.sum()
+    b0 = np.append(unit, 0)
+    b1 = np.append(0, unit) - b0
+    factor = (1 - advance - retention) * cv
+
+    release = 1 + dfp + n + 1 + np.maximum(dlp - 1, 0)
+    inflow = np.zeros((points, int(release.max()) + 1))
+    inflow[:, 0] = advance * cv
+    for shift in np.unique(dfp):
+        rows = np.flatnonzero(dfp == shift)
+        inflow[rows, 1 + shift:2 + shift + n] = (
+            factor[rows, None] * b0 + (factor * wieb)[rows, None] * b1)
+    rows = np.arange(points)
+    inflow[rows, 1 + dfp + n] += retention * cv * eop
+    inflow[rows, release] += retention * cv * (1 - eop)
+    return inflow, release + 1
+
+
+def sweep(project: Project, grid: dict) -> dict:
+    '''
+    Returns the grid points and their metrics (one list per metric)
+    '''
+    terms = grid_points(project, grid)
+    project_cf = Project_cf(project)
+    InvalidData.require_condition(project_cf.cost > 0, 'The project has no activities')
+    inflow, lengths = grid_inflow(project_cf.aggregate.work, terms)
+    outflow = project_cf.aggregate.out_flow
+    result = analytics.analyze(
+        inflow, outflow, terms['interest_rate'], np.maximum(lengths, len(outflow)))
+    irr = result['irr']
+    return {
+        'terms': list(grid),
+        'points': np.column_stack([terms[term] for term in grid]).tolist(),
+        'metrics': {
+            'peak_exposure': result['peak_exposure'].tolist(),
+            'peak_exposure_month': result['peak_exposure_month'].tolist(),
+            'npv': result['npv'].tolist(),
+            'irr': np.where(np.isnan(irr), None, irr).tolist(),
+            'financing_cost': result['financing_cost'].tolist(),
+            'final_cumulative_net': result['cumulative_net'][:, -1].tolist(),
+        },
+    }
@@ -0,0 +1,82 @@
+'''
+Sparse representation of the cashflow series.
+
+Most of a cashflow with a long dlp (or a long duration for payment) is made
+of zeros: the retention is released dlp months after the last payment. A
+Series keeps the length of the series and its runs of values, the zeros
+between the runs are not stored:
+
+    [0, 0, 5, 6, 0, 0, 0, 0, 0, 0, 7] -> length 11, runs [(2, [5, 6]), (10, [7])]
+
+Zero gaps shorter than GAP are kept inside the runs so a series does not
+break into many small runs. The series are stored and served in the JSON form
+{"length": n, "runs": [[start, [values]], ...]} and expanded to lists only
+at the API edge (see Series.to_list).
+'''
+import numpy as np
+
+GAP = 4
+
+
+class Series():
+    __slots__ = ('length', 'runs')
+
+    def __init__(self, length: int = 0, runs=()) -> None:
+        self.length = int(length)
+        self.runs = [(int(start), np.asarray(values, dtype=float)) for start, values in runs]
+
+    @classmethod
+    def from_dense(cls, values, gap: int = GAP) -> 'Series':
+        '''Splits a dense series on its runs of at least gap zeros'''
+        values = np.asarray(values, dtype=float)
+        nonzero = np.flatnonzero(values)
+        if not len(nonzero):
+            return cls(len(values))
+        breaks = np.flatnonzero(np.diff(nonzero) > gap)
+        starts = nonzero[np.r_[0, breaks + 1]]
+        ends = nonzero[np.r_[breaks, len(nonzero) - 1]] + 1
+        return cls(len(values), [(s, values[s:e]) for s, e in zip(starts, ends)])
+
+    @classmethod
+    def from_json(cls, data) -> 'Series':
+        '''Reads the JSON form, or a dense list'''
+        if data is None:
+            return cls()
+        if isinstance(data, dict):
+            return cls(data['length'], data['runs'])
+        return cls.from_dense(data)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def add_to(self, total: np.ndarray, offset: int = 0, sign=1) -> np.ndarray:
+        '''Adds the series to the dense array total starting at offset'''
+        for start, values in self.runs:
+            start += offset
+            total[start:start + len(values)] += sign * values
+        return total
+
+    def to_dense(self) -> np.ndarray:
+        return self.add_to(np.zeros(self.length))
+
+    def to_list(self) -> list:
+        return self.to_dense().tolist()
+
+    def sum(self) -> float:
+        return float(sum(values.sum() for _, values in self.runs))
+
+    def as_json(self) -> dict:
+        return {
+            'length': self.length,
+            'runs': [[start, values.tolist()] for start, values in self.runs],
+        }
+
+
+def as_json(values, series: str = 'dense'):
+    '''
+    The JSON form of a dense series at the API edge: a list if series is
+    "dense", the Series form if it is "sparse"
+    '''
+    if series == 'sparse':
+        return Series.from_dense(values).as_json()
+    return np.asarray(values, dtype=float).tolist()
@@ -0,0 +1,162 @@
+"""
+AsyncUser_API – asyncio counterpart of User_API for the async views
+
+Same surface as User_API (`post`, `get`, `verify_token`) with coroutines on
+httpx. It wraps the User_API of the app and shares its config, app token,
+verified token cache, refresh single-flight and latency metrics, so the sync
+and async views see the same state:
+
+    resp = await au_api.post("user/login", data={...})
+    user = await au_api.verify_token(token)
+
+Flask runs each async view in a new event loop, and an `httpx.AsyncClient`
+is bound to the loop it was opened in, so the requests are sent from one
+background loop per process (started on first use) holding one pooled
+keep-alive client for the lifetime of the process. The views await them
+without blocking their own loop. `to_thread` runs blocking calls (e.g.
+GoogleAuth) in the executor of the background loop, whose long-lived
+threads keep their pooled sessions between the requests.
+"""
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+import jwt
+from flask import current_app, g
+
+from q_flow.services.token_cache import TokenCache
+from q_flow.services.user_api import U_Api_resp, User_API
+
+log = logging.getLogger(__name__)
+
+
+class AsyncUser_API:
+    """Async QAuth client sharing the state of a User_API."""
+
+    def __init__(self, api: User_API) -> None:
+        self.api = api
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    # ------------------------- Internals ------------------------- #
+    def _new_client(self) -> httpx.AsyncClient:
+        api = self.api
+        connect, read = api.timeout
+        return httpx.AsyncClient(
+            # connection retries only, like the read=0 Retry of User_API
+            transport=httpx.AsyncHTTPTransport(retries=api.retries),
+            limits=httpx.Limits(max_connections=api.pool_size, max_keepalive_connections=api.pool_size),
+            timeout=httpx.Timeout(read, connect=connect),
+        )
+
+    def _background_loop(self) -> asyncio.AbstractEventLoop:
+        """The loop of the process running the HTTP calls, a new one in a forked process."""
+        with self._lock:
+            if self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="au_api", daemon=True).start()
+                self._loop, self._client, self._pid = loop, self._new_client(), os.getpid()
+            return self._loop
+
+    async def _run(self, coro):
+        """Runs the coroutine in the background loop and awaits it from the current loop."""
+        loop = self._background_loop()
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    async def to_thread(self, fn, *args, **kwargs):
+        """Like asyncio.to_thread on the (long-lived) executor of the background loop."""
+        async def in_executor():
+            return await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(fn, *args, **kwargs))
+        return await self._run(in_executor())
+
+    def _timeout(self, timeout) -> Optional[httpx.Timeout]:
+        if timeout is None:
+            return None
+        if isinstance(timeout, tuple):
+            return httpx.Timeout(timeout[1], connect=timeout[0])
+        return httpx.Timeout(timeout)
+
+    async def _request(self, method: str, route: str, timeout=None, **kwargs) -> U_Api_resp:
+        timeout = self._timeout(timeout)
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        return await self._run(self._send(method, route, **kwargs))
+
+    async def _send(self, method: str, route: str, **kwargs) -> U_Api_resp:
+        api = self.api
+        started = time.perf_counter()
+        resp = None
+        try:
+            resp = await self._client.request(method, api._build_url(route), **kwargs)
+        except httpx.ConnectError:
+            return U_Api_resp(503, "Service Unavailable: Unable to connect to QAuth.")
+        except httpx.TimeoutException:
+            return U_Api_resp(408, "Request Timeout: QAuth took too long to respond.")
+        except httpx.HTTPError as e:
+            return U_Api_resp(500, f"Request Error: {e}")
+        finally:
+            api._record(route, started, resp is None or resp.status_code >= 500)
+        return U_Api_resp(resp.status_code, api._extract_message(resp), resp)
+
+    # ------------------------- Public HTTP ------------------------- #
+    async def post(self, route: str, data: Optional[dict] = None, files: Optional[dict] = None,
+            token: Optional[str] = None, unit_id: Optional[str] = None, timeout=None) -> U_Api_resp:
+        """See User_API.post."""
+        return await self._request(
+            "POST", route,
+            json=data if not files else None,
+            data=data if files else None,
+            files=files,
+            headers=self.api._headers(token=token, unit_id=unit_id),
+            timeout=timeout,
+        )
+
+    async def get(self, route: str, data: Optional[dict] = None,
+            token: Optional[str] = None, unit_id: Optional[str] = None, timeout=None) -> U_Api_resp:
+        """See User_API.get."""
+        return await self._request(
+            "GET", route,
+            params=data,
+            headers=self.api._headers(token=token, unit_id=unit_id),
+            timeout=timeout,
+        )
+
+    # ------------------------- Token Verification/Refresh ------------------------- #
+    async def verify_token(self, token: str) -> Dict[str, Any]:
+        """See User_API.verify_token, only the refresh awaits QAuth."""
+        api = self.api
+        if current_app.config.get("TESTING") or not token:
+            return api.verify_token(token)
+
+        for refreshes in range(api.max_refreshes + 1):
+            try:
+                return api._decode(token)
+            except jwt.ExpiredSignatureError:
+                if refreshes == api.max_refreshes:
+                    break
+                log.warning("Token expired; attempting refresh")
+                refresh = await self._refresh(token)
+                if refresh.get("error"):
+                    return refresh
+                token = g.new_token = refresh["token"]
+        return {"error": "Token refresh failed: the refreshed token is expired"}
+
+    async def _refresh(self, token: str) -> Dict[str, Any]:
+        """Shares the in-flight refreshes (and cached failures) of User_API."""
+        return await self.api.refreshes.do_async(
+            TokenCache.key(token),
+            lambda: self._post_refresh(token),
+            failed=lambda result: "error" in result,
+        )
+
+    async def _post_refresh(self, token: str) -> Dict[str, Any]:
+        return User_API._refresh_result(
+            await self.post("user/refresh_token", data={"refresh_token": token}))
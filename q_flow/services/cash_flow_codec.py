@@ -0,0 +1,74 @@
+'''
+Compact binary encoding of the activity cashflow series (see
+Activity.cash_flow_data).
+
+A cashflow is a dict of named series, e.g. marginal_work and
+marginal_out_flow. Each series is stored as its runs of packed little endian
+floats without the zeros between them (the start of the activity, the months
+of the dlp, see series.py):
+
+    b"QCF1" | count (uint8)
+    for each series:
+        name length (uint8) | name (utf-8) | dtype ("d" float64, "f" float32)
+        | length (uint32, series length) | runs (uint32)
+        for each run:
+            start (uint32) | length (uint32, packed values) | values
+'''
+import struct
+import numpy as np
+
+from q_flow.series import Series
+
+MAGIC = b"QCF1"
+DTYPES = {b"d": np.dtype("<f8"), b"f": np.dtype("<f4")}
+
+
+def encode(cash_flow: dict, dtype=b"d") -> bytes:
+    '''
+    Packs the series of the cashflow dict. dtype b"f" halves the size at the
+    cost of float32 precision.
+    '''
+    parts = [MAGIC, struct.pack("<B", len(cash_flow))]
+    for name, series in cash_flow.items():
+        series = series if isinstance(series, Series) else Series.from_dense(series)
+        name = name.encode()
+        parts.append(struct.pack("<B", len(name)))
+        parts.append(name)
+        parts.append(struct.pack("<cII", dtype, series.length, len(series.runs)))
+        for start, values in series.runs:
+            parts.append(struct.pack("<II", start, len(values)))
+            parts.append(values.astype(DTYPES[dtype]).tobytes())
+    return b"".join(parts)
+
+
+def decode_series(data: bytes) -> dict:
+    '''
+    Unpacks the series as Series
+    '''
+    if data[:4] != MAGIC:
+        raise ValueError("Invalid cashflow data")
+    (count,), offset = struct.unpack_from("<B", data, 4), 5
+    cash_flow = {}
+    for _ in range(count):
+        (name_length,) = struct.unpack_from("<B", data, offset)
+        offset += 1
+        name = data[offset:offset + name_length].decode()
+        offset += name_length
+        dtype, total, count_runs = struct.unpack_from("<cII", data, offset)
+        offset += struct.calcsize("<cII")
+        dtype = DTYPES[dtype]
+        series = []
+        for _ in range(count_runs):
+            start, length = struct.unpack_from("<II", data, offset)
+            offset += struct.calcsize("<II")
+            series.append((start, np.frombuffer(data, dtype=dtype, count=length, offset=offset)))
+            offset += length * dtype.itemsize
+        cash_flow[name] = Series(total, series)
+    return cash_flow
+
+
+def decode(data: bytes) -> dict:
+    '''
+    Unpacks the series as lists of floats, the format of cash_flow_json
+    '''
+    return {name: series.to_list() for name, series in decode_series(data).items()}
@@ -0,0 +1,169 @@
+"""
+GoogleAuth – verification of the Google sign-in tokens of google_login
+
+- `verify_id_token` checks an ID token against Google's signing certs. The
+  certs are cached for the max-age of their Cache-Control header (Google
+  rotates them a few times a week) and fetched again when a token is signed
+  with an unknown key id, at most once per GOOGLE_CERTS_MIN_REFRESH seconds.
+- `userinfo` returns the profile of an access token from the userinfo
+  endpoint. Lookups are cached for GOOGLE_USERINFO_TTL seconds per token
+  (keyed by digest, see token_cache.py).
+
+The HTTP calls go through `transport`, a `google.auth.transport.Request`
+(callable(url, method, body, headers, timeout) returning status/headers/data).
+By default a `google.auth.transport.requests.Request` on a pooled keep-alive
+session per thread; tests plug in a local stand-in.
+
+Optional app.config keys:
+    GOOGLE_CLIENT_ID (str) – Audience of the ID tokens
+    GOOGLE_CERTS_URL, GOOGLE_USERINFO_URL (str)
+    GOOGLE_CONNECT_TIMEOUT, GOOGLE_READ_TIMEOUT (float) – Timeouts (seconds)
+    GOOGLE_USERINFO_TTL (float) – Seconds a userinfo lookup is cached, 0 disables the cache
+    GOOGLE_CERTS_MIN_REFRESH (float) – Min seconds between the cert fetches of unknown key ids
+"""
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import requests
+from flask import Flask
+from google.auth import jwt as g_jwt
+from google.auth.transport import requests as g_requests
+from requests.adapters import HTTPAdapter
+
+from q_flow.services.token_cache import TokenCache
+
+CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+USERINFO_URL = "https://www.googleapis.com/oauth2/v3/userinfo"
+ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+def max_age(headers) -> int:
+    """Seconds a response can be cached from its Cache-Control and Age headers."""
+    headers = {k.lower(): v for k, v in (headers or {}).items()}
+    control = headers.get("cache-control") or ""
+    match = _MAX_AGE.search(control)
+    if not match or "no-store" in control or "no-cache" in control:
+        return 0
+    try:
+        age = int(headers.get("age") or 0)
+    except ValueError:
+        age = 0
+    return max(int(match.group(1)) - age, 0)
+
+
+class GoogleAuth:
+    """Google ID token / access token verification with cached certs and userinfo."""
+
+    def __init__(self, transport=None) -> None:
+        self.transport = transport
+        self.client_id: str = ""
+        self.certs_url: str = CERTS_URL
+        self.userinfo_url: str = USERINFO_URL
+        self.timeout = (3.05, 10)
+        self.userinfo_ttl: float = 60
+        self.clock_skew: int = 1
+        self.certs_min_refresh: float = 60
+        self.userinfo_cache = TokenCache()
+        self.cert_fetches = 0
+        self._certs: Dict[str, str] = {}
+        self._certs_exp: float = 0
+        self._certs_fetched: Optional[float] = None
+        self._certs_lock = threading.Lock()
+        self._local = threading.local()
+
+    def init_app(self, app: Flask) -> None:
+        self.client_id = app.config.get("GOOGLE_CLIENT_ID", "")
+        self.certs_url = app.config.get("GOOGLE_CERTS_URL", CERTS_URL)
+        self.userinfo_url = app.config.get("GOOGLE_USERINFO_URL", USERINFO_URL)
+        self.timeout = (
+            app.config.get("GOOGLE_CONNECT_TIMEOUT", self.timeout[0]),
+            app.config.get("GOOGLE_READ_TIMEOUT", self.timeout[1]),
+        )
+        self.userinfo_ttl = app.config.get("GOOGLE_USERINFO_TTL", self.userinfo_ttl)
+        self.certs_min_refresh = app.config.get("GOOGLE_CERTS_MIN_REFRESH", self.certs_min_refresh)
+
+    # ------------------------- Transport ------------------------- #
+    def _session(self) -> requests.Session:
+        """The keep-alive session of the current thread, a new one in a forked process."""
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=1)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            local.session, local.pid = session, os.getpid()
+        return local.session
+
+    def _get(self, url: str, headers: Optional[dict] = None):
+        transport = self.transport or g_requests.Request(self._session())
+        # google's requests transport takes one timeout, the read timeout bounds both
+        return transport(url, method="GET", headers=headers, timeout=self.timeout[1])
+
+    # ------------------------- ID tokens ------------------------- #
+    def certs(self, refresh: bool = False) -> Dict[str, str]:
+        """Google's signing certs by key id, fetched when the cached ones are stale."""
+        with self._certs_lock:
+            if not refresh and self._certs and time.monotonic() < self._certs_exp:
+                return self._certs
+            return self._fetch_certs()
+
+    def _fetch_certs(self) -> Dict[str, str]:
+        resp = self._get(self.certs_url)
+        if resp.status != 200:
+            raise ValueError(f"Could not fetch Google certificates ({resp.status})")
+        self._certs = json.loads(resp.data)
+        self._certs_fetched = time.monotonic()
+        self._certs_exp = self._certs_fetched + max_age(resp.headers)
+        self.cert_fetches += 1
+        return self._certs
+
+    def _certs_throttled(self) -> bool:
+        """True if the certs were fetched less than certs_min_refresh seconds ago."""
+        fetched = self._certs_fetched
+        return fetched is not None and time.monotonic() - fetched < self.certs_min_refresh
+
+    def certs_for(self, kid: Optional[str]) -> Dict[str, str]:
+        """The certs, fetched again if kid is unknown and they were not fetched recently."""
+        certs = self.certs()
+        if not kid or kid in certs or self._certs_throttled():
+            return certs
+        with self._certs_lock:
+            # another thread may have fetched them while this one waited
+            if kid in self._certs or self._certs_throttled():
+                return self._certs
+            return self._fetch_certs()
+
+    def verify_id_token(self, token: str, audience: Optional[str] = None) -> Dict[str, Any]:
+        """The claims of a Google ID token, raises ValueError if it is invalid."""
+        audience = audience or self.client_id
+        # the certs are fetched again for a key newer than the cached ones
+        kid = g_jwt.decode_header(token).get("kid")
+        claims = g_jwt.decode(token, certs=self.certs_for(kid), audience=audience,
+            clock_skew_in_seconds=self.clock_skew)
+        if claims.get("iss") not in ISSUERS:
+            raise ValueError(f"Wrong issuer: {claims.get('iss')}")
+        return claims
+
+    # ------------------------- Access tokens ------------------------- #
+    def userinfo(self, access_token: str) -> Dict[str, Any]:
+        """The Google profile of an access token, raises ValueError if it is invalid."""
+        cached = self.userinfo_cache.get(access_token)
+        if cached is not None:
+            return dict(cached["info"])
+        resp = self._get(self.userinfo_url, headers={"Authorization": f"Bearer {access_token}"})
+        if resp.status != 200:
+            raise ValueError(f"Invalid access token ({resp.status})")
+        info = json.loads(resp.data)
+        if self.userinfo_ttl > 0:
+            self.userinfo_cache.put(access_token, {"exp": time.time() + self.userinfo_ttl, "info": info})
+        return dict(info)
+
+    def info(self) -> Dict[str, Any]:
+        """Cert fetches and userinfo cache counters."""
+        return {"cert_fetches": self.cert_fetches, "userinfo": self.userinfo_cache.info()}
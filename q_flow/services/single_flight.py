@@ -0,0 +1,133 @@
+'''
+Single-flight calls: concurrent calls with the same key share one execution.
+
+The first caller of a key runs the function, the callers arriving while it
+runs wait for it and get the same result (or exception). Failed results
+(see SingleFlight.do) are kept for failure_ttl seconds and returned to the
+following callers of the key without running the function again. The
+expired failures are dropped by the following calls and at most
+max_failures are kept.
+
+Used by User_API.verify_token (and AsyncUser_API.verify_token, see do_async)
+so the parallel requests of a client holding the same expired token make one
+refresh call to QAuth.
+'''
+import asyncio
+from collections import OrderedDict
+from threading import Event, Lock
+from time import monotonic
+
+
+class _Call():
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self) -> None:
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight():
+    def __init__(self, failure_ttl=5.0, max_failures=1024) -> None:
+        self.failure_ttl = failure_ttl
+        self.max_failures = max_failures
+        self.calls = 0
+        self.shared = 0
+        self.cached_failures = 0
+        self._calls = {}
+        # key: (deadline, call), in the order of the deadlines (same ttl)
+        self._failures = OrderedDict()
+        self._lock = Lock()
+
+    def _prune(self) -> None:
+        '''Drops the expired failures and the oldest ones above max_failures'''
+        now = monotonic()
+        failures = self._failures
+        while failures and (
+                len(failures) > self.max_failures or next(iter(failures.values()))[0] <= now):
+            failures.popitem(last=False)
+
+    def _join(self, key):
+        '''
+        Returns (call, leader) for a caller of the key, call is the cached
+        failure if any
+        '''
+        with self._lock:
+            self._prune()
+            failure = self._failures.get(key)
+            if failure is not None:
+                self.cached_failures += 1
+                return failure[1], False
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+                return call, True
+            self.shared += 1
+            return call, False
+
+    def _finish(self, key, call: _Call, failed) -> None:
+        with self._lock:
+            del self._calls[key]
+            if call.error is not None or (failed is not None and failed(call.result)):
+                self._failures[key] = (monotonic() + self.failure_ttl, call)
+                self._failures.move_to_end(key)
+                self._prune()
+        call.done.set()
+
+    def do(self, key, fn, failed=None):
+        '''
+        Returns fn() running it at most once at a time per key.
+        failed: a function of the result, True if the result is a failure to
+        keep for failure_ttl seconds. Exceptions are failures too.
+        '''
+        call, leader = self._join(key)
+        if not leader:
+            call.done.wait()
+            return self._result(call)
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+        self._finish(key, call, failed)
+        return self._result(call)
+
+    async def do_async(self, key, fn, failed=None):
+        '''
+        Same as do for a coroutine function fn. The sync and async callers of
+        a key share the same calls (the waiters wait in a thread, the callers
+        can run in different event loops).
+        '''
+        call, leader = self._join(key)
+        if not leader:
+            if not call.done.is_set():
+                await asyncio.to_thread(call.done.wait)
+            return self._result(call)
+        try:
+            call.result = await fn()
+        except Exception as e:
+            call.error = e
+        self._finish(key, call, failed)
+        return self._result(call)
+
+    @staticmethod
+    def _result(call: _Call):
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._failures.clear()
+            self.calls = 0
+            self.shared = 0
+            self.cached_failures = 0
+
+    def info(self) -> dict:
+        return {
+            'calls': self.calls,
+            'shared': self.shared,
+            'cached_failures': self.cached_failures,
+            'in_flight': len(self._calls),
+            'failures': len(self._failures),
+        }
@@ -0,0 +1,77 @@
+'''
+Bounded cache of verified user tokens (see User_API.verify_token).
+
+The claims of a verified token are kept until the token expires (its exp
+claim) so the following requests with the same token skip the signature
+verification. The tokens are keyed by their sha256 digest, the tokens
+themselves are not kept as keys. The least recently used entries are
+dropped when the cache is full.
+'''
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+from time import time
+
+
+class TokenCache():
+    def __init__(self, maxsize=1024) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self._claims = OrderedDict()
+        self._lock = Lock()
+
+    @staticmethod
+    def key(token: str) -> str:
+        return sha256(token.encode()).hexdigest()
+
+    def get(self, token: str):
+        '''
+        Returns a copy of the claims of the token, None if the token is not
+        cached or has expired
+        '''
+        key = self.key(token)
+        with self._lock:
+            entry = self._claims.get(key)
+            if entry is not None and entry[0] <= time():
+                del self._claims[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._claims.move_to_end(key)
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, token: str, claims: dict) -> None:
+        '''
+        Caches the claims of a verified token until its exp, tokens without
+        exp are not cached
+        '''
+        exp = claims.get('exp')
+        if not isinstance(exp, (int, float)) or exp <= time() or self.maxsize <= 0:
+            return
+        key = self.key(token)
+        with self._lock:
+            self._claims[key] = (exp, dict(claims))
+            self._claims.move_to_end(key)
+            while len(self._claims) > self.maxsize:
+                self._claims.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._claims.clear()
+            self.hits = 0
+            self.misses = 0
+            self.expired = 0
+
+    def info(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'size': len(self._claims),
+            'maxsize': self.maxsize,
+        }
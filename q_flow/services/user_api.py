@@ -157,15 +157,35 @@ Required app.config keys:
 
 Optional:
     TESTING       (bool) – When True, verify_token returns a test user
+    TOKEN_CACHE_SIZE (int) – Verified tokens kept until their exp (see token_cache.py), 0 disables the cache
+    USER_API_POOL_SIZE (int) – Keep-alive connections kept per worker thread
+    USER_API_RETRIES (int) – Retries of failed connections (and of GET on 502/503/504)
+    USER_API_BACKOFF (float) – Backoff factor between the retries (seconds)
+    USER_API_CONNECT_TIMEOUT, USER_API_READ_TIMEOUT (float) – Default timeouts (seconds)
+    TOKEN_REFRESH_FAILURE_TTL (float) – Seconds a failed refresh of a token is not retried
+    TOKEN_MAX_REFRESHES (int) – Refreshes of an expired token in one verification
+
+HTTP calls go through one `requests.Session` per thread and per process (a
+session is not shared by threads and is recreated in a forked worker) so the
+TCP/TLS connections to QAuth are reused. The latency of each route is
+recorded, see `latency_info`.
 """
 import logging
+import os
+import threading
+import time
 from datetime import datetime, timedelta, timezone
 from typing import Any, Dict, Optional
 
 import jwt
 import requests
 from flask import Flask, current_app, g
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError, Timeout, HTTPError
+from urllib3.util.retry import Retry
+
+from q_flow.services.single_flight import SingleFlight
+from q_flow.services.token_cache import TokenCache
 
 log = logging.getLogger(__name__)
 
@@ -195,6 +215,16 @@ class User_API:
         self.app_secret: str = ""
         self.app_algo: str = "HS256"
         self._app_token_cache: Dict[str, Any] = {"value": None, "exp": 0}
+        self.token_cache = TokenCache()
+        self.pool_size: int = 10
+        self.retries: int = 2
+        self.backoff: float = 0.3
+        self.timeout = (3.05, 30)
+        self._local = threading.local()
+        self._latency: Dict[str, Dict[str, float]] = {}
+        self._latency_lock = threading.Lock()
+        self.refreshes = SingleFlight()
+        self.max_refreshes: int = 1
 
     def init_app(self, app: Flask) -> None:
         self.app = app
@@ -205,6 +235,16 @@ class User_API:
         self.algo = app.config.get("ALGO", "HS256")
         self.app_secret = app.config.get("APP_SECRET", "")
         self.app_algo = app.config.get("APP_ALGO", "HS256")
+        self.token_cache = TokenCache(app.config.get("TOKEN_CACHE_SIZE", 1024))
+        self.pool_size = app.config.get("USER_API_POOL_SIZE", self.pool_size)
+        self.retries = app.config.get("USER_API_RETRIES", self.retries)
+        self.backoff = app.config.get("USER_API_BACKOFF", self.backoff)
+        self.timeout = (
+            app.config.get("USER_API_CONNECT_TIMEOUT", self.timeout[0]),
+            app.config.get("USER_API_READ_TIMEOUT", self.timeout[1]),
+        )
+        self.refreshes = SingleFlight(app.config.get("TOKEN_REFRESH_FAILURE_TTL", 5.0))
+        self.max_refreshes = app.config.get("TOKEN_MAX_REFRESHES", self.max_refreshes)
 
         missing = [k for k, v in {
             "USER_API_URL": self.url,
@@ -247,6 +287,66 @@ class User_API:
             pass
         return response
 
+    def _new_session(self) -> requests.Session:
+        retry = Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=0,
+            status=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=(502, 503, 504),  # only for idempotent methods (GET)
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _session(self) -> requests.Session:
+        """The session of the current thread, a new one in a forked process."""
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            local.session = self._new_session()
+            local.pid = os.getpid()
+        return local.session
+
+    def _record(self, route: str, started: float, error: bool) -> None:
+        elapsed = time.perf_counter() - started
+        with self._latency_lock:
+            stats = self._latency.setdefault(
+                route, {"count": 0, "errors": 0, "total": 0.0, "max": 0.0})
+            stats["count"] += 1
+            stats["errors"] += int(error)
+            stats["total"] += elapsed
+            stats["max"] = max(stats["max"], elapsed)
+
+    def latency_info(self) -> Dict[str, Dict[str, float]]:
+        """Calls, errors (no response or status >= 500), mean and max latency (seconds) per route."""
+        with self._latency_lock:
+            return {
+                route: dict(stats, mean=stats["total"] / stats["count"])
+                for route, stats in self._latency.items()
+            }
+
+    def _request(self, method: str, route: str, timeout=None, **kwargs) -> U_Api_resp:
+        url = self._build_url(route)
+        started = time.perf_counter()
+        resp = None
+        try:
+            resp = self._session().request(method, url, timeout=timeout or self.timeout, **kwargs)
+        except ConnectionError:
+            return U_Api_resp(503, "Service Unavailable: Unable to connect to QAuth.")
+        except Timeout:
+            return U_Api_resp(408, "Request Timeout: QAuth took too long to respond.")
+        except requests.RequestException as e:
+            return U_Api_resp(500, f"Request Error: {e}")
+        finally:
+            self._record(route, started, resp is None or resp.status_code >= 500)
+        # Do not raise_for_status; we return status/content to caller unchanged
+        msg = self._extract_message(resp)
+        return U_Api_resp(resp.status_code, msg, resp)
+
     def _build_url(self, route: str) -> str:
         return f"{self.url.rstrip('/')}/{route.lstrip('/')}"
 
@@ -272,14 +372,16 @@ class User_API:
         return token
 
     def _extract_message(self, response: requests.Response) -> str:
+        # requests has `reason`, httpx (AsyncUser_API) has `reason_phrase`
+        reason = getattr(response, "reason", None) or getattr(response, "reason_phrase", "")
         ctype = (response.headers.get("content-type") or "").lower()
         if "application/json" in ctype:
             try:
                 js = response.json()
-                return (js.get("message") or js.get("error") or "").strip() or response.reason
+                return (js.get("message") or js.get("error") or "").strip() or reason
             except ValueError:
-                return response.text or response.reason
-        return response.text or response.reason
+                return response.text or reason
+        return response.text or reason
 
     def _headers(self, token: Optional[str] = None, unit_id: Optional[str] = None) -> Dict[str, str]:
         hdrs = {
@@ -293,51 +395,37 @@ class User_API:
 
     # ------------------------- Public HTTP ------------------------- #
     def post(self, route: str, data: Optional[dict] = None, files: Optional[dict] = None,
-            token: Optional[str] = None, unit_id: Optional[str] = None, timeout: int = 30) -> U_Api_resp:
-        """Backward-compatible POST. Added optional token/unit_id/timeout without breaking callers."""
-        url = self._build_url(route)
-        try:
-            resp = requests.post(
-                url,
-                json=data if not files else None,
-                data=data if files else None,
-                files=files,
-                headers=self._headers(token=token, unit_id=unit_id),
-                timeout=timeout,
-            )
-        except ConnectionError:
-            return U_Api_resp(503, "Service Unavailable: Unable to connect to QAuth.")
-        except Timeout:
-            return U_Api_resp(408, "Request Timeout: QAuth took too long to respond.")
-        except requests.RequestException as e:
-            return U_Api_resp(500, f"Request Error: {e}")
-        # Do not raise_for_status; we return status/content to caller unchanged
-        msg = self._extract_message(resp)
-        return U_Api_resp(resp.status_code, msg, resp)
+            token: Optional[str] = None, unit_id: Optional[str] = None, timeout=None) -> U_Api_resp:
+        """Backward-compatible POST. Added optional token/unit_id/timeout without breaking callers.
+        timeout defaults to the (connect, read) timeouts of the config."""
+        return self._request(
+            "POST", route,
+            json=data if not files else None,
+            data=data if files else None,
+            files=files,
+            headers=self._headers(token=token, unit_id=unit_id),
+            timeout=timeout,
+        )
 
     def get(self, route: str, data: Optional[dict] = None,
-            token: Optional[str] = None, unit_id: Optional[str] = None, timeout: int = 30) -> U_Api_resp:
-        url = self._build_url(route)
-        try:
-            resp = requests.get(
-                url,
-                params=data,
-                headers=self._headers(token=token, unit_id=unit_id),
-                timeout=timeout,
-            )
-        except ConnectionError:
-            return U_Api_resp(503, "Service Unavailable: Unable to connect to QAuth.")
-        except Timeout:
-            return U_Api_resp(408, "Request Timeout: QAuth took too long to respond.")
-        except requests.RequestException as e:
-            return U_Api_resp(500, f"Request Error: {e}")
-        msg = self._extract_message(resp)
-        return U_Api_resp(resp.status_code, msg, resp)
+            token: Optional[str] = None, unit_id: Optional[str] = None, timeout=None) -> U_Api_resp:
+        return self._request(
+            "GET", route,
+            params=data,
+            headers=self._headers(token=token, unit_id=unit_id),
+            timeout=timeout,
+        )
+
+    def token_cache_info(self) -> Dict[str, int]:
+        """Hit/miss/expired counters and size of the verified token cache."""
+        return self.token_cache.info()
 
     # ------------------------- Token Verification/Refresh ------------------------- #
     def verify_token(self, token: str) -> Dict[str, Any]:
         """Verify a user token with QAuth's PUBLIC_KEY/ALGO.
         If expired, try to refresh via `user/refresh_token` and stash new token in `g.new_token`.
+        An expired token is refreshed at most `max_refreshes` times (the refreshed token
+        could be expired too, e.g. clock skew).
         """
         if current_app.config.get("TESTING"):
             return {
@@ -354,6 +442,26 @@ class User_API:
         if not token:
             return {"error": "Token not provided"}
 
+        for refreshes in range(self.max_refreshes + 1):
+            try:
+                return self._decode(token)
+            except jwt.ExpiredSignatureError:
+                if refreshes == self.max_refreshes:
+                    break
+                log.warning("Token expired; attempting refresh")
+                refresh = self._refresh(token)
+                if refresh.get("error"):
+                    return refresh
+                token = g.new_token = refresh["token"]
+        return {"error": "Token refresh failed: the refreshed token is expired"}
+
+    def _decode(self, token: str) -> Dict[str, Any]:
+        """The claims of the token or an error, raises ExpiredSignatureError."""
+        # Tokens already verified skip the signature check until their exp
+        cached = self.token_cache.get(token)
+        if cached is not None:
+            return cached
+
         try:
             decoded = jwt.decode(token, self.public_key, algorithms=[self.algo], audience=self.app_id)
             # App binding safety check
@@ -362,20 +470,10 @@ class User_API:
             if not decoded.get("name") and decoded.get("email"):
                 decoded["name"] = decoded["email"].split("@")[0]
             decoded["token"] = token
+            self.token_cache.put(token, decoded)
             return decoded
         except jwt.ExpiredSignatureError:
-            log.warning("Token expired; attempting refresh")
-            refresh = self.post("user/refresh_token", data={"refresh_token": token})
-            if refresh.error:
-                return {"error": refresh.message}
-            try:
-                new_tok = refresh.response.json().get("data", {}).get("token")
-            except Exception:
-                new_tok = None
-            if not new_tok:
-                return {"error": "Token refresh failed"}
-            g.new_token = new_tok
-            return self.verify_token(new_tok)
+            raise
         except jwt.InvalidSignatureError:
             return {"error": "Invalid Token Signature"}
         except jwt.InvalidAudienceError:
@@ -389,3 +487,28 @@ class User_API:
         except Exception as e:
             log.error(f"Unexpected verify_token error: {e}")
             return {"error": f"Unexpected error: {e}"}
+
+    def _refresh(self, token: str) -> Dict[str, Any]:
+        """{"token": new token} or {"error": message}. Concurrent refreshes of the same
+        expired token share one QAuth call and failures are kept for a few seconds
+        (see single_flight.py)."""
+        return self.refreshes.do(
+            TokenCache.key(token),
+            lambda: self._post_refresh(token),
+            failed=lambda result: "error" in result,
+        )
+
+    def _post_refresh(self, token: str) -> Dict[str, Any]:
+        return self._refresh_result(self.post("user/refresh_token", data={"refresh_token": token}))
+
+    @staticmethod
+    def _refresh_result(refresh: U_Api_resp) -> Dict[str, Any]:
+        if refresh.error:
+            return {"error": refresh.message}
+        try:
+            new_tok = refresh.response.json().get("data", {}).get("token")
+        except Exception:
+            new_tok = None
+        if not new_tok:
+            return {"error": "Token refresh failed"}
+        return {"token": new_tok}
@@ -0,0 +1,312 @@
+'''
+Monte Carlo risk simulation of the project cashflow.
+
+Each iteration samples, for every activity:
+1. duration: a factor applied to the activity duration (rounded, >= 1)
+2. skew: a value added to the activity skew (clipped to -0.95..0.95)
+3. start_delay: periods added to the activity start (rounded, >= 0)
+and for the project:
+4. payment_delay: periods added to the client duration for payment
+    (rounded, >= 0)
+
+The distributions are dicts with a "dist" key and its parameters:
+    {"dist": "fixed", "value": 0}
+    {"dist": "uniform", "low": 0, "high": 2}
+    {"dist": "triangular", "low": 0.9, "mode": 1, "high": 1.3}
+    {"dist": "normal", "mean": 0, "std": 0.1}
+    {"dist": "poisson", "lam": 0.5}
+The parameters must be within the BOUNDS of their term and the samples are
+clipped to them (e.g. the tails of a normal distribution), so the size of
+the simulated cashflows stays bounded.
+
+The iterations are computed together: for each activity the iterations are
+grouped by sampled duration and every group is one 2-D computation (one row
+per iteration) through the cashflow stages of engine.py. The iterations can
+be split over a process pool (processes > 1).
+
+The result holds the percentile bands (e.g. P10/P50/P90) of the inflow, the
+outflow and the cumulative net position (inflow - outflow) of the project.
+'''
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from q_flow import curves
+from q_flow.engine import out_flow, sub_bill_work, sub_payments
+from q_flow.exceptions import InvalidData
+from q_flow.params import ActivityParams, ProjectParams, cast
+
+DEFAULT_DISTRIBUTIONS = {
+    "duration": {"dist": "triangular", "low": 0.9, "mode": 1.0, "high": 1.3},
+    "skew": {"dist": "normal", "mean": 0.0, "std": 0.1},
+    "start_delay": {"dist": "triangular", "low": 0, "mode": 0, "high": 2},
+    "payment_delay": {"dist": "uniform", "low": 0, "high": 1},
+}
+DEFAULT_ITERATIONS = 1000
+DEFAULT_PERCENTILES = (10, 50, 90)
+MAX_PERCENTILES = 20
+
+# bounds of the parameters and samples of each term: a factor of the
+# duration, a value added to the skew and delays in periods
+BOUNDS = {
+    "duration": (0.0, 4.0),
+    "skew": (-2.0, 2.0),
+    "start_delay": (0.0, 120.0),
+    "payment_delay": (0.0, 24.0),
+}
+
+# parameters of each distribution and their default (None: required)
+DISTRIBUTIONS = {
+    "fixed": {"value": 0.0},
+    "uniform": {"low": None, "high": None},
+    "triangular": {"low": None, "mode": None, "high": None},
+    "normal": {"mean": 0.0, "std": 1.0},
+    "poisson": {"lam": None},
+}
+
+
+def check_distribution(term: str, spec: dict) -> dict:
+    '''
+    Returns the distribution spec of the term with its parameters cast to
+    floats, raises InvalidData if the spec is not valid or out of the bounds
+    of the term
+    '''
+    InvalidData.require_condition(term in BOUNDS, f"Unknown simulation term {term}")
+    InvalidData.require_condition(
+        isinstance(spec, dict), f"The {term} distribution must be an object")
+    dist = spec.get("dist", "fixed")
+    InvalidData.require_condition(dist in DISTRIBUTIONS, f"Unknown distribution {dist}")
+    checked = {"dist": dist}
+    for name, default in DISTRIBUTIONS[dist].items():
+        value = spec.get(name, default)
+        InvalidData.require_condition(
+            value is not None, f"Missing {name} of the {term} distribution")
+        checked[name] = cast(f"{term} {name}", float, value)
+    low, high = BOUNDS[term]
+    for name, value in checked.items():
+        if name == "std":
+            InvalidData.require_condition(
+                0 <= value <= high - low, f"{term} std must be between 0 and {high - low:g}")
+        elif name != "dist":
+            InvalidData.require_condition(
+                low <= value <= high, f"{term} {name} must be between {low:g} and {high:g}")
+    ordered = [checked[name] for name in ("low", "mode", "high") if name in checked]
+    InvalidData.require_condition(
+        ordered == sorted(ordered), f"The {term} distribution must have low <= mode <= high")
+    return checked
+
+
+def sample(rng: np.random.Generator, spec: dict, size) -> np.ndarray:
+    '''
+    Draws size samples from the distribution spec
+    '''
+    spec = dict(spec)
+    dist = spec.pop("dist", "fixed")
+    try:
+        if dist == "fixed":
+            return np.full(size, float(spec.get("value", 0)))
+        if dist == "uniform":
+            return rng.uniform(spec["low"], spec["high"], size)
+        if dist == "triangular":
+            if spec["low"] == spec["high"]:
+                return np.full(size, float(spec["low"]))
+            return rng.triangular(spec["low"], spec["mode"], spec["high"], size)
+        if dist == "normal":
+            return rng.normal(spec.get("mean", 0), spec.get("std", 1), size)
+        if dist == "poisson":
+            return rng.poisson(spec["lam"], size).astype(float)
+    except (KeyError, TypeError, ValueError) as e:
+        raise InvalidData(f"Invalid parameters for distribution {dist}: {e}")
+    raise InvalidData(f"Unknown distribution {dist}")
+
+
+def _place(total, rows, offsets, block, ends=None):
+    '''
+    Adds block[i] to total[rows[i]] starting at column offsets[i]. The rows
+    are first shifted into a block aligned on the smallest offset so they are
+    added to total in one operation.
+    '''
+    count, width = block.shape
+    first = offsets.min()
+    shift = offsets - first
+    if shift.any():
+        shifted = np.zeros((count, width + shift.max()))
+        index = (np.arange(count) * shifted.shape[1] + shift)[:, None] + np.arange(width)
+        shifted.ravel()[index] = block
+        block = shifted
+    total[rows, first:first + block.shape[1]] += block
+    if ends is not None:
+        np.maximum.at(ends, rows, offsets + width)
+
+
+def _activity_lengths(a: ActivityParams, duration: int) -> tuple:
+    '''
+    Lengths of the work and the outflow of an activity of a given duration
+    (see the stages in engine.py)
+    '''
+    work = a.mobilization_period + duration
+    bill = max(work, a.no_billing_period + 1) + 1
+    payments = a.duration_for_payment + bill + max(a.dlp - 1, 0)
+    return work, max(payments, work)
+
+
+def simulate_chunk(project: ProjectParams, activities: list, distributions: dict,
+        iterations: int, seed) -> tuple:
+    '''
+    Runs iterations of the simulation. project is a ProjectParams and
+    activities a list of ActivityParams (see params.py), plain objects so the
+    chunk can run in a worker process. Returns the inflow and outflow
+    matrices, one row per iteration.
+    '''
+    rng = np.random.default_rng(seed)
+    n = iterations
+    count = len(activities)
+    base_duration = np.array([a.duration for a in activities], dtype=float)
+    base_skew = np.array([a.skew for a in activities], dtype=float)
+    base_start = np.array([a.start for a in activities], dtype=int)
+
+    def draw(term, size):
+        return np.clip(sample(rng, distributions[term], size), *BOUNDS[term])
+
+    durations = np.maximum(np.rint(
+        base_duration * draw("duration", (n, count))), 1).astype(int)
+    skews = np.clip(base_skew + draw("skew", (n, count)), -0.95, 0.95)
+    starts = base_start + np.rint(draw("start_delay", (n, count))).astype(int)
+    payment_delays = np.rint(draw("payment_delay", n)).astype(int)
+
+    length = max(
+        int(starts[:, k].max()) + _activity_lengths(a, int(durations[:, k].max()))[1]
+        for k, a in enumerate(activities))
+    work = np.zeros((n, length))
+    outflow = np.zeros((n, length))
+    work_end = np.zeros(n, dtype=int)
+
+    for k, a in enumerate(activities):
+        for d in np.unique(durations[:, k]):
+            rows = np.flatnonzero(durations[:, k] == d)
+            curve = curves._marginal_rows(
+                int(d), skews[rows, k], np.full(len(rows), float(a.cost)),
+                np.full(len(rows), a.linear))
+            bill = sub_bill_work(
+                curve, a.mobilization_period, a.no_billing_period,
+                a.subcontracted, a.work_in_excess, a.retention,
+                a.advance)
+            payments = sub_payments(
+                bill, a.duration_for_payment, a.dlp, a.cost,
+                a.subcontracted, a.advance, a.retention,
+                a.release_retention_eop)
+            out = out_flow(payments, curve, a.mobilization_period, a.subcontracted)
+            offsets = starts[rows, k]
+            _place(work, rows, offsets + a.mobilization_period, curve, work_end)
+            _place(outflow, rows, offsets, out)
+
+    return project_inflow(project, work, work_end, payment_delays), outflow
+
+
+def project_inflow(project: ProjectParams, work, work_end, payment_delays) -> np.ndarray:
+    '''
+    Vectorized Project_cf.inflow: one row of work per iteration, work_end is
+    the length of the project work of each iteration.
+    '''
+    n, length = work.shape
+    cv = project.contract_value
+    advance, retention = project.advance, project.retention
+    wieb, eop = project.wieb, project.release_retention_eop
+    dlp = project.dlp
+
+    factored = work * (cv / work.sum(axis=1))[:, None]
+    bill = np.zeros((n, length + 1))
+    bill[:, :length] += factored * (1 - wieb)
+    bill[:, 1:] += factored * wieb
+    bill *= 1 - (advance + retention)
+
+    delays = project.duration_for_payment + payment_delays
+    inflow = np.zeros((n, 1 + int(delays.max()) + length + 1 + max(dlp, 1)))
+    inflow[:, 0] = advance * cv
+    rows = np.arange(n)
+    _place(inflow, rows, 1 + delays, bill)
+
+    # retention released at the end of the project and at the end of the dlp
+    end = 1 + delays + work_end
+    inflow[rows, end] += retention * cv * eop
+    inflow[rows, end + max(dlp, 1)] += retention * cv * (1 - eop)
+    return inflow
+
+
+def _band(matrix, percentiles) -> dict:
+    values = np.percentile(matrix, percentiles, axis=0)
+    return {f"p{p:g}": v.tolist() for p, v in zip(percentiles, values)}
+
+
+def simulate(project, activities=None, config: dict = None) -> dict:
+    '''
+    Runs the Monte Carlo simulation of a Project (model). config keys:
+        iterations: number of iterations (default 1000)
+        max_iterations: the maximum number of iterations (no maximum if None)
+        seed: seed of the random generator
+        processes: number of worker processes (default 1, no pool)
+        percentiles: the percentile bands (default 10, 50, 90)
+        distributions: overrides of DEFAULT_DISTRIBUTIONS
+    Invalid config values raise InvalidData.
+    '''
+    config = config or {}
+    if activities is None:
+        activities = [a for a in project.activities if not a.is_deleted]
+    InvalidData.require_condition(activities, "The project has no activities")
+    project_params = ProjectParams.of(project)
+    activity_params = [ActivityParams.of(a) for a in activities]
+    InvalidData.require_condition(
+        sum(a.cost for a in activity_params) > 0, "The project has no cost")
+
+    overrides = config.get("distributions") or {}
+    InvalidData.require_condition(
+        isinstance(overrides, dict), "distributions must be an object")
+    distributions = dict(DEFAULT_DISTRIBUTIONS, **overrides)
+    distributions = {
+        term: check_distribution(term, spec) for term, spec in distributions.items()}
+
+    iterations = cast("iterations", int, config.get("iterations", DEFAULT_ITERATIONS))
+    InvalidData.require_condition(iterations > 0, "iterations must be positive")
+    max_iterations = config.get("max_iterations")
+    InvalidData.require_condition(
+        max_iterations is None or iterations <= max_iterations,
+        f"Maximum {max_iterations} iterations")
+    processes = int(config.get("processes") or 1)
+
+    percentiles = config.get("percentiles") or DEFAULT_PERCENTILES
+    InvalidData.require_condition(
+        isinstance(percentiles, (list, tuple)) and len(percentiles) <= MAX_PERCENTILES,
+        f"percentiles must be a list of at most {MAX_PERCENTILES} numbers")
+    percentiles = [cast("percentiles", float, p) for p in percentiles]
+    InvalidData.require_condition(
+        all(0 <= p <= 100 for p in percentiles), "percentiles must be between 0 and 100")
+    percentiles = [int(p) if p.is_integer() else p for p in percentiles]
+
+    chunks = min(max(processes, 1), iterations)
+    sizes = [len(c) for c in np.array_split(np.arange(iterations), chunks)]
+    seeds = np.random.SeedSequence(config.get("seed")).spawn(chunks)
+    args = [(project_params, activity_params, distributions, size, seed)
+        for size, seed in zip(sizes, seeds)]
+    if chunks > 1:
+        with ProcessPoolExecutor(max_workers=chunks) as pool:
+            results = list(pool.map(simulate_chunk, *zip(*args)))
+    else:
+        results = [simulate_chunk(*args[0])]
+
+    # align the chunks and the inflow/outflow on the same number of periods
+    length = max(m.shape[1] for result in results for m in result)
+    def stack(index):
+        return np.vstack([np.pad(r[index], ((0, 0), (0, length - r[index].shape[1])))
+            for r in results])
+    inflow, outflow = stack(0), stack(1)
+    used = np.flatnonzero(inflow.any(axis=0) | outflow.any(axis=0))
+    length = int(used[-1]) + 1 if len(used) else 1
+    inflow, outflow = inflow[:, :length], outflow[:, :length]
+
+    return {
+        "iterations": iterations,
+        "percentiles": percentiles,
+        "inflow": _band(inflow, percentiles),
+        "outflow": _band(outflow, percentiles),
+        "cumulative_net": _band(np.cumsum(inflow - outflow, axis=1), percentiles),
+    }
@@ -0,0 +1,91 @@
+'''
+Calendar axis of the cashflow series.
+
+The engines compute monthly series indexed by the month offset from the
+start of the project (Project.start_month). This module gives them dates and
+re-buckets them to other frequencies:
+1. week: each month is spread over its days and the days are summed by week
+    (weeks start on Monday)
+2. month: the series as computed
+3. quarter: the months are summed by calendar quarter
+
+The re-bucketing of a series of a given start month and length uses an index
+map (source month, target bucket, share of the month) computed once and
+cached, so re-bucketing is one np.bincount.
+'''
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+import numpy as np
+
+from q_flow.exceptions import InvalidData
+
+FREQUENCIES = ('week', 'month', 'quarter')
+
+
+def month_start(value) -> date:
+    '''The first day of the month of a date, a datetime or an ISO string'''
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.replace(day=1)
+
+
+def add_months(start: date, months: int) -> date:
+    '''The first day of the month months after the month of start'''
+    index = start.year * 12 + start.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_offset(origin, value) -> int:
+    '''Number of months from the month of origin to the month of value'''
+    return (value.year - origin.year) * 12 + value.month - origin.month
+
+
+@lru_cache(maxsize=1024)
+def bucket_map(start: date, length: int, freq: str) -> tuple:
+    '''
+    Returns (months, buckets, shares, labels): month i of the series adds
+    shares[k] of its value to bucket buckets[k] for months[k] == i. labels
+    are the first days of the buckets. The arrays are read-only.
+    '''
+    InvalidData.require_condition(freq in FREQUENCIES, f'Unknown frequency {freq}')
+    start = month_start(start)
+    months = np.arange(length)
+    if freq == 'month':
+        buckets = months
+        shares = np.ones(length)
+        labels = tuple(add_months(start, i) for i in range(length))
+    elif freq == 'quarter':
+        first = (start.month - 1) % 3
+        buckets = (months + first) // 3
+        shares = np.ones(length)
+        labels = tuple(
+            add_months(start, 3 * i - first) for i in range(int(buckets[-1]) + 1 if length else 0))
+    else:
+        first = np.datetime64(start, 'D')
+        days = np.arange(first, np.datetime64(add_months(start, length), 'D'))
+        day_months = (days.astype('datetime64[M]') - first.astype('datetime64[M]')).astype(int)
+        monday = first - (first.astype(datetime).weekday())
+        day_weeks = (days - monday).astype(int) // 7
+        weeks = int(day_weeks[-1]) + 1 if length else 0
+        pairs, counts = np.unique(day_months * weeks + day_weeks, return_counts=True)
+        months, buckets = pairs // weeks, pairs % weeks
+        days_in_month = np.bincount(day_months, minlength=length)
+        shares = counts / days_in_month[months]
+        labels = tuple(monday.astype(datetime) + timedelta(weeks=i) for i in range(weeks))
+    for array in (months, buckets, shares):
+        array.flags.writeable = False
+    return months, buckets, shares, labels
+
+
+def rebucket(series, start, freq: str = 'month') -> tuple:
+    '''
+    Returns the labels (ISO dates) and the values of a monthly series
+    starting in the month of start summed by freq
+    '''
+    series = np.asarray(series, dtype=float)
+    months, buckets, shares, labels = bucket_map(month_start(start), len(series), freq)
+    values = np.bincount(buckets, weights=series[months] * shares, minlength=len(labels))
+    return [label.isoformat() for label in labels], values
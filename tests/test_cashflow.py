@@ -1,11 +1,23 @@
 
+from datetime import date
+from math import exp
 from tracemalloc import start
+import numpy as np
 from flask_testing import TestCase
 from q_flow.models.activity import Activity
 from q_flow.models.project import Project
-from q_flow.cashflow import Activity_cf, Project_cf
+from q_flow import analytics, curves, engine, simulation, timeline
+from q_flow.exceptions import InvalidData
+from q_flow.models.activity import ActivityType
+from q_flow.recompute import activity_filters, recompute
+from q_flow.params import ActivityParams, ProjectParams
+from q_flow.series import Series
+from q_flow.services import cash_flow_codec
+from q_flow.cashflow import Activity_cf, CashFlowAggregate, Project_cf, Work
 from tests.base import Base
-from q_flow.extensions import fs
+from q_flow.extensions import db, fs
+from sqlalchemy import text
+from sqlalchemy.orm import Session
 
 
 class Test_cashflow(Base, TestCase):
@@ -56,4 +68,492 @@ class Test_cashflow(Base, TestCase):
         project_cf.printProject()
         project_cf.print_project_cashflow()
         project_cf.print_gantt()
-        
\ No newline at end of file
+
+    def full_aggregate(self):
+        aggregate = CashFlowAggregate()
+        for activity in self.project.activities:
+            if not activity.is_deleted:
+                aggregate.add(activity.cash_flow_json)
+        return aggregate
+
+    def assert_same(self, a, b):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            assert abs(x - y) < 1e-6
+
+    def test_incremental_aggregate(self):
+        Project_cf(self.project)
+        assert self.project.cash_flow_json is not None
+
+        # update an activity
+        activity = self.project.activities[0]
+        old = activity.cash_flow_json
+        activity.cost = 500000
+        activity.duration = 30
+        Activity_cf(activity).set_cashflow()
+        Project_cf.update_activity(self.project, old=old, new=activity.cash_flow_json)
+        incremental = Project_cf(self.project)
+        full = self.full_aggregate()
+        self.assert_same(incremental.aggregate.work, full.work)
+        self.assert_same(incremental.aggregate.out_flow, full.out_flow)
+        assert incremental.duration == full.duration
+
+        # delete the longest activity, the aggregate shrinks back
+        activity.delete()
+        Project_cf.update_activity(self.project, old=activity.cash_flow_json)
+        incremental = Project_cf(self.project)
+        full = self.full_aggregate()
+        self.assert_same(incremental.aggregate.work, full.work)
+        self.assert_same(incremental.aggregate.out_flow, full.out_flow)
+        # start 4 + mobilization 1 + duration 6
+        assert incremental.duration == 11
+
+        # a concurrent change between the read and the write of the aggregate
+        # clears it, it is rebuilt from the activities
+        activity = self.project.activities[0]
+        add = CashFlowAggregate.add
+        def concurrent_add(aggregate, cash_flow, **kwargs):
+            db.session.execute(text(
+                "UPDATE project SET cash_flow_version = cash_flow_version + 1"))
+            add(aggregate, cash_flow, **kwargs)
+        CashFlowAggregate.add = concurrent_add
+        try:
+            Project_cf.update_activity(self.project, new=activity.cash_flow_json)
+        finally:
+            CashFlowAggregate.add = add
+        assert self.project.cash_flow_json is None
+        full = self.full_aggregate()
+        self.assert_same(Project_cf(self.project).aggregate.work, full.work)
+
+
+    def test_concurrent_rebuild(self):
+        # an activity edited by another session while the aggregate is rebuilt
+        activity_id = self.project.activities[0].id
+        costs = sum(a.cost for a in self.project.activities)
+        _sum = Project_cf._sum
+        def concurrent_sum(activities):
+            aggregate = _sum(activities)
+            with Session(db.engine) as other:
+                activity = other.get(Activity, activity_id)
+                activity.cost = 5000
+                activity.cash_flow_json = Activity_cf(activity).as_json()
+                other.commit()
+            return aggregate
+        Project_cf._sum = staticmethod(concurrent_sum)
+        try:
+            assert self.project.cash_flow_json is None
+            Project_cf(self.project)
+        finally:
+            Project_cf._sum = staticmethod(_sum)
+        # the stale aggregate is not stored
+        assert Project.query.get(self.project.id).cash_flow_json is None
+        project_cf = Project_cf(Project.query.get(self.project.id))
+        assert abs(project_cf.cost - (costs - 100000 + 5000)) < 1e-6
+        assert Project.query.get(self.project.id).cash_flow_json is not None
+
+    def test_cash_flow_snapshot(self):
+        snapshot = self.project.cash_flow()
+        version = self.project.cash_flow_version
+        assert snapshot['version'] == version
+        assert len(snapshot['inflow']) > 0
+        assert self.project.cash_flow() == snapshot
+
+        # changing the contract terms invalidates the snapshot
+        self.project.advance = 0.2
+        self.project.commit()
+        assert self.project.cash_flow_version == version + 1
+        assert self.project.cash_flow()['inflow']['runs'][0] == [0, [0.2 * 1100000]]
+
+        # changing an activity invalidates the snapshot
+        activity = self.project.activities[0]
+        activity.cost = 400000
+        Activity_cf(activity).set_cashflow()
+        assert self.project.cash_flow_version == version + 2
+
+        # renaming the project does not
+        self.project.name = "renamed"
+        self.project.commit()
+        assert self.project.cash_flow_version == version + 2
+
+        # a term change after a concurrent bump still increments the version
+        assert self.project.cash_flow_version == version + 2
+        db.session.execute(text(
+            "UPDATE project SET cash_flow_version = cash_flow_version + 1"))
+        self.project.advance = 0.3
+        self.project.commit()
+        assert self.project.cash_flow_version == version + 4
+
+    def test_analytics(self):
+        project_cf = Project_cf(self.project)
+        inflow, outflow = project_cf.inflow(), project_cf.outflow()
+        result = project_cf.analytics()
+        rate = self.project.interest_rate
+
+        # month by month reference
+        length = max(len(inflow), len(outflow))
+        inflow = inflow + [0] * (length - len(inflow))
+        outflow = outflow + [0] * (length - len(outflow))
+        position, peak, peak_month, npv, cost = 0, 0, 0, 0, 0
+        for t in range(length):
+            net = inflow[t] - outflow[t]
+            position += net
+            if position < peak:
+                peak, peak_month = position, t
+            npv += net / (1 + rate) ** t
+            cost += max(-position, 0) * rate
+            assert abs(result["net"][t] - net) < 1e-6
+            assert abs(result["cumulative_net"][t] - position) < 1e-6
+        print(result)
+        assert abs(result["peak_exposure"] - peak) < 1e-6
+        assert result["peak_exposure_month"] == peak_month
+        assert abs(result["npv"] - npv) < 1e-6
+        assert abs(result["financing_cost"] - cost) < 1e-6
+        irr_npv = sum(n / (1 + result["irr"]) ** t for t, n in enumerate(result["net"]))
+        assert abs(irr_npv) < 1e-3
+
+        # the same pass on a batch of cashflows, one per row
+        batch = analytics.analyze(np.array([inflow, inflow]), np.array([outflow, outflow]), rate)
+        assert np.allclose(batch["npv"], result["npv"])
+        assert np.isnan(analytics.irr(np.array([1.0, 2.0])))
+
+        # a cashflow always in surplus has no peak exposure
+        surplus = analytics.analyze(np.array([5.0, 1.0, 3.0]), np.array([1.0, 2.0, 1.0]), rate)
+        assert surplus["peak_exposure"] == 0 and surplus["peak_exposure_month"] == 0
+
+        # cached with the project cashflow
+        assert self.project.cash_flow()["analytics"] == result
+        assert self.project.as_dict_with_activities()["analytics"] == result
+
+    def test_simulation(self):
+        # without uncertainty every iteration is the deterministic cashflow
+        fixed = {
+            "duration": {"dist": "fixed", "value": 1},
+            "skew": {"dist": "fixed", "value": 0},
+            "start_delay": {"dist": "fixed", "value": 0},
+            "payment_delay": {"dist": "fixed", "value": 0},
+            }
+        result = simulation.simulate(
+            self.project, config={"iterations": 5, "distributions": fixed})
+        cf = Project_cf(self.project)
+        inflow = result["inflow"]["p50"]
+        assert np.allclose(inflow[:len(cf.inflow())], cf.inflow())
+        assert np.allclose(result["outflow"]["p10"][:len(cf.outflow())], cf.outflow())
+        assert result["inflow"]["p10"] == result["inflow"]["p90"]
+
+        result = simulation.simulate(self.project, config={"iterations": 200, "seed": 1})
+        print(result["cumulative_net"]["p50"])
+        for p10, p50, p90 in zip(*result["cumulative_net"].values()):
+            assert p10 <= p50 <= p90
+        assert result == simulation.simulate(self.project, config={"iterations": 200, "seed": 1})
+
+        # invalid configs are rejected
+        for config in [
+                {"iterations": "many"}, {"iterations": -5}, {"iterations": 50, "max_iterations": 10},
+                {"percentiles": ["x"]}, {"percentiles": [10, 150]}, {"percentiles": 50},
+                {"distributions": {"duration": {"dist": "fixed", "value": 1000}}},
+                {"distributions": {"duration": {"dist": "uniform", "low": 2, "high": 1}}},
+                {"distributions": {"skew": {"dist": "normal", "std": "wide"}}},
+                {"distributions": {"rain": {"dist": "fixed"}}}]:
+            with self.assertRaises(InvalidData):
+                simulation.simulate(self.project, config=config)
+
+        # the end of each row of shifted blocks
+        total, ends = np.zeros((2, 10)), np.zeros(2, dtype=int)
+        simulation._place(total, np.arange(2), np.array([0, 3]), np.ones((2, 2)), ends)
+        assert ends.tolist() == [2, 5] and total.sum() == 4
+
+        # the samples are clipped to the bounds of their term
+        result = simulation.simulate(self.project, config={"iterations": 50, "seed": 1,
+            "distributions": {"start_delay": {"dist": "normal", "mean": 120, "std": 100}}})
+        assert len(result["inflow"]["p50"]) < 2 * 120 + len(cf.inflow())
+
+class Test_curves(Base, TestCase):
+    '''Test the NumPy curve engine against the month by month formula'''
+    @staticmethod
+    def loop_marginal_work(d, s, c, ct="s"):
+        def skewed(t):
+            if ct == "l":
+                return c/d * t
+            return c*(s+1)/((s+1)+exp(-(t/(0.1*d)+s**2-5)))
+        t_work = [skewed(t) for t in range(0, d + 1)]
+        er = c - sum(t_work[t+1] - t_work[t] for t in range(0, d))
+        for t in range(0, d + 1):
+            t_work[t] += -(2*er*t**3)/(d**3) + (3*er*t**2)/(d**2)
+        return [t_work[t+1] - t_work[t] for t in range(0, d)]
+
+    def test_marginal_work(self):
+        for d in [1, 2, 6, 25, 120]:
+            for s in [-0.8, -0.5, 0, 0.33, 0.9]:
+                for ct in ["s", "l"]:
+                    expected = self.loop_marginal_work(d, s, 250000, ct)
+                    result = Work(d, s, 250000, ct).marginal_work()
+                    assert len(result) == d
+                    for r, e in zip(result, expected):
+                        assert abs(r - e) < 1e-6
+                    assert abs(sum(result) - 250000) < 1e-6
+
+    def test_cumulative_work(self):
+        cw = Work(12, -0.5, 1000).cumulative_work()
+        assert len(cw) == 12
+        assert abs(cw[-1] - 1000) < 1e-9
+
+    def test_batch_marginal_work(self):
+        durations = [6, 3, 6, 12]
+        skews = [0, -0.5, 0.9, 0.33]
+        costs = [1000, 2000, 3000, 4000]
+        types = ["s", "s", "l", "s"]
+        ragged = curves.batch_marginal_work(durations, skews, costs, types)
+        padded = curves.batch_marginal_work(durations, skews, costs, types, padded=True)
+        assert padded.shape == (4, 12)
+        for i in range(4):
+            expected = Work(durations[i], skews[i], costs[i], types[i]).marginal_work()
+            assert len(ragged[i]) == durations[i]
+            for r, p, e in zip(ragged[i], padded[i], expected):
+                assert abs(r - e) < 1e-9
+                assert abs(p - e) < 1e-9
+            assert not padded[i, durations[i]:].any()
+
+    def test_unit_curve_cache(self):
+        curves.unit_curves.clear()
+        w1 = Work(7, -0.2, 1000).marginal_work()
+        w2 = Work(7, -0.2, 3000).marginal_work()
+        info = curves.cache_info()
+        assert info["misses"] == 1
+        assert info["hits"] == 1
+        for a, b in zip(w1, w2):
+            assert abs(3 * a - b) < 1e-9
+        unit = curves.unit_marginal_work(7, -0.2)
+        assert unit is curves.unit_marginal_work(7, -0.2)
+        assert not unit.flags.writeable
+
+    def test_cubic_basis(self):
+        cumulative, marginal = curves.cubic_basis(12)
+        assert curves.cubic_basis(12)[0] is cumulative
+        assert not cumulative.flags.writeable and not marginal.flags.writeable
+        for t in range(13):
+            assert abs(cumulative[t] - (3 * t**2 / 12**2 - 2 * t**3 / 12**3)) < 1e-12
+        assert abs(marginal.sum() - 1) < 1e-12
+        # one row per activity of the same duration
+        rows = curves._marginal_rows(
+            9, np.array([-0.5, 0.3]), np.array([100.0, 250.0]), np.array([False, True]))
+        assert np.allclose(rows[0], self.loop_marginal_work(9, -0.5, 100.0, "s"))
+        assert np.allclose(rows[1], self.loop_marginal_work(9, 0.3, 250.0, "l"))
+
+
+class Test_activity_cf(Base, TestCase):
+    '''Test the cached series of Activity_cf'''
+    def test_cached_series(self):
+        activity = Activity(
+            name="a", cost=1000.0, duration=6, start=2, skew=0.0,
+            activity_type="General", advance=0.1, retention=0.1,
+            release_retention_eop=0.5, dlp=3, duration_for_payment=1,
+            work_in_excess=0.1, mobilization_period=1, subcontracted=0.7,
+            no_billing_period=0)
+        cf = Activity_cf(activity)
+        out = cf.out_flow()
+        assert out is cf.out_flow()
+        assert cf.sub_payments() is cf.sub_payments()
+        assert not out.flags.writeable
+        assert abs(cf.cumulative_work()[-1] - 1000) < 1e-9
+
+        # changing a parameter clears the cache
+        activity.cost = 2000.0
+        new_out = cf.out_flow()
+        assert new_out is not out
+        for a, b in zip(out, new_out):
+            assert abs(2 * a - b) < 1e-9
+
+
+class Test_params(Base, TestCase):
+    '''Test the validated cashflow parameters'''
+    def test_activity_params(self):
+        activity = Activity(name="a", cost="1000", duration=6, skew=0.2)
+        params = ActivityParams.of(activity)
+        print(params)
+        # the fields not set take the column defaults
+        assert params.cost == 1000.0 and params.duration == 6
+        assert params.mobilization_period == 1 and params.dlp == 0
+        assert not params.linear
+        assert ActivityParams.of(activity, activity_type="linear").linear
+        assert not hasattr(params, '__dict__')
+
+        for changes in [{"duration": 0}, {"duration": 2.5}, {"cost": float("nan")},
+                {"cost": -1}, {"start": -1}, {"skew": 1}, {"retention": 1.5},
+                {"cost": "abc"}]:
+            try:
+                ActivityParams.of(activity, **changes)
+                assert False, changes
+            except InvalidData as e:
+                print(e)
+
+    def test_project_params(self):
+        project = Project(name="p", contract_value=1000, dlp=12)
+        params = ProjectParams.of(project)
+        assert params.advance == 0.1 and params.dlp == 12
+        for changes in [{"advance": -0.1}, {"dlp": -1}, {"interest_rate": -1},
+                {"contract_value": float("inf")}]:
+            try:
+                ProjectParams.of(project, **changes)
+                assert False, changes
+            except InvalidData as e:
+                print(e)
+
+        # a project without cost has no inflow
+        project = Project(name="p", created_by="1", contract_value=1000).commit()
+        try:
+            Project_cf(project).inflow()
+            assert False
+        except InvalidData as e:
+            print(e)
+
+
+class Test_engine(Base, TestCase):
+    '''Test the engine computes the cashflows without the models'''
+    def test_engine(self):
+        project = Project(name="p", created_by="1", contract_value=5000, dlp=3).commit()
+        activities = [
+            Activity(project_id=project.id, name=f"a{i}", created_by="1",
+                cost=1000.0 * (i + 1), duration=4 + i, start=i).commit()
+            for i in range(3)]
+        params = [ActivityParams.of(a) for a in activities]
+        cash_flows = engine.ActivityCashFlow.batch(params)
+        aggregate = CashFlowAggregate()
+        for activity, cash_flow in zip(activities, cash_flows):
+            assert np.allclose(cash_flow.out_flow(), Activity_cf(activity).out_flow())
+            aggregate.add(cash_flow.as_json())
+
+        terms = ProjectParams(
+            advance=0.1, retention=0.1, release_retention_eop=0.5, dlp=3,
+            duration_for_payment=1, interest_rate=0.005, contract_value=5000,
+            wieb=0.2)
+        inflow = engine.project_inflow(terms, aggregate.work).to_list()
+        print(inflow)
+        assert np.allclose(inflow, Project_cf(project).inflow())
+        assert abs(sum(inflow) - 5000) < 1e-6
+
+
+class Test_recompute(Base, TestCase):
+    '''Test the bulk recompute of the activities cashflows'''
+    def test_recompute(self):
+        project = Project(name="p", created_by="1", contract_value=5000).commit()
+        for i in range(5):
+            activity = Activity(project_id=project.id, name=f"a{i}", created_by="1",
+                cost=1000.0, duration=4 + i, activity_type="Structure", skew=0.3).commit()
+            Activity_cf(activity).set_cashflow()
+        project.cash_flow()
+        project_id, version = project.id, project.cash_flow_version
+        updated_at = project.updated_at
+
+        calls = []
+        done = recompute(activity_filters([project_id]), batch_size=2, reset_skew=True,
+            progress=lambda done, total: calls.append((done, total)))
+        print(calls)
+        assert done == 5
+        assert calls == [(2, 5), (4, 5), (5, 5)]
+
+        project = Project.query.get(project_id)
+        assert project.cash_flow_json is None
+        # the version is bumped by each batch of the project
+        assert project.cash_flow_version > version
+        assert project.updated_at == updated_at
+        for activity in project.activities:
+            assert activity.skew == ActivityType.STRUCTURE.skew
+            expected = Activity_cf(activity).as_json()
+            assert np.allclose(activity.cash_flow_json["marginal_out_flow"], expected["marginal_out_flow"])
+        assert project.cash_flow()['version'] == project.cash_flow_version
+        assert project.cash_flow_json is not None
+
+
+class Test_cash_flow_codec(Base, TestCase):
+    '''Test the binary storage of the activity cashflow'''
+    def test_round_trip(self):
+        cash_flow = {
+            "marginal_work": [0.0, 0.0, 0.0, 1.5, 2.25, 0.0, 3.125],
+            "marginal_out_flow": [0.0, 1.0 / 3.0, 0.0],
+            }
+        data = cash_flow_codec.encode(cash_flow)
+        assert cash_flow_codec.decode(data) == cash_flow
+        assert len(cash_flow_codec.encode(cash_flow, dtype=b"f")) < len(data)
+
+    def test_sparse_series(self):
+        dense = [0.0, 0.0, 5.0, 6.0, 0.0, 7.0] + [0.0] * 59 + [8.0]
+        series = Series.from_dense(dense)
+        assert series.as_json() == {'length': 66, 'runs': [[2, [5.0, 6.0, 0.0, 7.0]], [65, [8.0]]]}
+        assert Series.from_json(series.as_json()).to_list() == dense
+        assert Series.from_json(dense).to_list() == dense
+
+        # the zeros of the dlp are not stored
+        data = cash_flow_codec.encode({"marginal_out_flow": dense})
+        assert len(data) < 8 * len(dense)
+        assert cash_flow_codec.decode(data) == {"marginal_out_flow": dense}
+
+    def test_activity_cash_flow(self):
+        project = Project(name="p", created_by="1").commit()
+        legacy = {"marginal_work": [0.0, 1.0], "marginal_out_flow": [0.5, 0.5]}
+        activity = Activity(
+            name="a", created_by="1", project_id=project.id,
+            legacy_cash_flow_json=legacy).commit()
+        assert activity.cash_flow_json == legacy
+        Activity_cf(activity).set_cashflow()
+        assert activity.legacy_cash_flow_json is None
+        assert activity.cash_flow_data is not None
+        assert activity.as_dict()["cash_flow_json"] == activity.cash_flow_json
+        assert "cash_flow_data" not in activity.as_dict()
+
+    def test_migrate(self):
+        project = Project(name="p", created_by="1").commit()
+        legacy = {"marginal_work": [0.0, 1.0], "marginal_out_flow": [0.5, 0.5]}
+        for i in range(3):
+            Activity(name=f"a{i}", created_by="1", project_id=project.id,
+                legacy_cash_flow_json=legacy).commit()
+        empty = Activity(name="e", created_by="1", project_id=project.id).commit()
+        # a JSON null written by the former column type
+        db.session.execute(text("UPDATE activity SET cash_flow_json = 'null' WHERE id = :id"),
+            {"id": empty.id})
+        db.session.commit()
+
+        result = self.app.test_cli_runner().invoke(args=["migrate-cf", "-b", "2"])
+        print(result.output)
+        assert result.exception is None
+        assert "3 activities to migrate" in result.output
+        for activity in Activity.query.filter(Activity.id != empty.id):
+            assert activity.cash_flow_data is not None
+            assert activity.cash_flow_json == legacy
+
+        # None is stored as SQL NULL
+        Activity(name="n", created_by="1", project_id=project.id,
+            legacy_cash_flow_json=None).commit()
+        assert db.session.execute(text(
+            "SELECT COUNT(*) FROM activity WHERE cash_flow_json IS NOT NULL")).scalar() == 1
+
+
+class Test_timeline(Base, TestCase):
+    '''Test the calendar axis and the re-bucketing of the monthly series'''
+    def test_rebucket(self):
+        series = [1.0, 2.0, 3.0, 4.0, 5.0]
+        dates, values = timeline.rebucket(series, date(2024, 2, 10), 'month')
+        assert dates == ['2024-02-01', '2024-03-01', '2024-04-01', '2024-05-01', '2024-06-01']
+        assert values.tolist() == series
+
+        # february and march are in the first quarter, april to june in the second
+        dates, values = timeline.rebucket(series, date(2024, 2, 10), 'quarter')
+        assert dates == ['2024-01-01', '2024-04-01']
+        assert values.tolist() == [3.0, 12.0]
+
+        dates, values = timeline.rebucket(series, date(2024, 2, 10), 'week')
+        assert dates[0] == '2024-01-29'
+        assert all(date.fromisoformat(d).weekday() == 0 for d in dates)
+        assert abs(values.sum() - sum(series)) < 1e-9
+        # the first week has 4 of the 29 days of february 2024
+        assert abs(values[0] - 4 / 29) < 1e-9
+
+    def test_dated_project(self):
+        project = Project(name="p", created_by="1", start_date="2024-05-17").commit()
+        assert project.start_date == date(2024, 5, 17)
+        assert project.start_month == date(2024, 5, 1)
+        Activity(project_id=project.id, name="a", created_by="1", cost=1000, duration=6,
+            start=3).commit()
+        as_dict = project.as_dict_with_activities(freq='quarter')
+        assert as_dict['activities'][0]['start_date'] == '2024-08-01'
+        assert as_dict['dates'][0] == '2024-04-01'
+        assert abs(sum(as_dict['inflow']) - Series.from_json(project.cash_flow()['inflow']).sum()) < 1e-6
@@ -0,0 +1,112 @@
+from time import time
+import json
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from flask_testing import TestCase
+from google.auth import crypt
+from google.auth import jwt as g_jwt
+from q_flow.services.google_auth import GoogleAuth, max_age
+from tests.base import Base
+
+
+def rsa_key():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()).decode()
+    public = key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo).decode()
+    return private, public
+
+
+class Response():
+    def __init__(self, status, data, headers=None):
+        self.status = status
+        self.data = json.dumps(data).encode()
+        self.headers = headers or {}
+
+
+class FakeTransport():
+    '''
+    Local stand-in of Google's certs and userinfo endpoints
+    '''
+    def __init__(self):
+        self.calls = []
+        self.certs = {}
+        self.cache_control = 'public, max-age=3600'
+        self.userinfo_status = 200
+
+    def __call__(self, url, method='GET', body=None, headers=None, timeout=None):
+        self.calls.append(url)
+        assert timeout
+        if url.endswith('certs'):
+            return Response(200, self.certs, {'Cache-Control': self.cache_control, 'Age': '100'})
+        return Response(self.userinfo_status, {'email': 'test@example.com', 'name': 'Test'})
+
+
+class Test_google_auth(Base, TestCase):
+    '''
+    Test the Google certs and userinfo caches
+    '''
+    def setUp(self):
+        self.transport = FakeTransport()
+        self.auth = GoogleAuth(transport=self.transport)
+        self.auth.init_app(self.app)
+        self.auth.client_id = 'client'
+
+    def sign(self, kid, private, **claims):
+        claims = dict({
+            'iss': 'https://accounts.google.com', 'aud': 'client', 'email': 'test@example.com',
+            'iat': int(time()), 'exp': int(time()) + 600}, **claims)
+        return g_jwt.encode(crypt.RSASigner.from_string(private, kid), claims).decode()
+
+    def test_max_age(self):
+        assert max_age({'Cache-Control': 'public, max-age=3600', 'Age': '100'}) == 3500
+        assert max_age({'cache-control': 'no-cache, max-age=60'}) == 0
+        assert max_age({}) == 0
+
+    def test_verify_id_token(self):
+        private, public = rsa_key()
+        self.transport.certs = {'k1': public}
+        token = self.sign('k1', private)
+        for _ in range(3):
+            claims = self.auth.verify_id_token(token)
+            assert claims['email'] == 'test@example.com'
+        print(self.auth.info())
+        assert self.transport.calls.count(self.auth.certs_url) == 1
+
+        # rotated keys are fetched again, at most once per certs_min_refresh
+        private2, public2 = rsa_key()
+        self.transport.certs = {'k1': public, 'k2': public2}
+        with self.assertRaises(ValueError):
+            self.auth.verify_id_token(self.sign('k2', private2))
+        assert self.auth.cert_fetches == 1
+        self.auth._certs_fetched -= self.auth.certs_min_refresh
+        assert self.auth.verify_id_token(self.sign('k2', private2))['aud'] == 'client'
+        assert self.auth.cert_fetches == 2
+
+        # unknown key ids do not fetch the certs again
+        for _ in range(3):
+            with self.assertRaises(ValueError):
+                self.auth.verify_id_token(self.sign('k3', private2))
+        assert self.auth.cert_fetches == 2
+
+        for token in [self.sign('k1', private, aud='other'),
+                self.sign('k1', private, iss='evil.com'), self.sign('k1', private2)]:
+            with self.assertRaises(ValueError):
+                self.auth.verify_id_token(token)
+
+        # certs without max-age are not cached
+        self.transport.cache_control = 'no-cache'
+        self.auth.certs(refresh=True)
+        self.auth.verify_id_token(self.sign('k1', private))
+        assert self.auth.cert_fetches == 4
+
+    def test_userinfo(self):
+        for _ in range(3):
+            assert self.auth.userinfo('access')['email'] == 'test@example.com'
+        assert self.transport.calls == [self.auth.userinfo_url]
+
+        self.transport.userinfo_status = 401
+        with self.assertRaises(ValueError):
+            self.auth.userinfo('bad')
@@ -1,9 +1,13 @@
 
+from datetime import datetime
 from io import BytesIO
 import os
 import re
 from flask_testing import TestCase
+from q_flow.cashflow import Activity_cf, Project_cf
+from q_flow.models.activity import Activity
 from q_flow.models.project import Project
+from q_flow.scenario import Overlay
 from tests.base import Base
 from q_flow.extensions import fs
 
@@ -296,3 +300,215 @@ class Test_project_routes(Base, TestCase):
         assert len(re.findall(b'test_project_', resp.data)) == 4
 
 
+    def test_projects_listing_activities(self):
+        '''
+        Test the projects listing skips deleted activities and their cashflow
+        '''
+        project = Project(
+            name='test_project', description='test description',
+            created_by='1', contract_value=1000).commit()
+        for name in ['activity_1', 'activity_2']:
+            resp = self.client.post(f'/new_activity/{project.id}',
+                headers={'Authorization': 'Bearer test_token'},
+                json={'name': name, 'cost': 1000, 'duration': 4})
+            assert resp.status_code == 201
+        Activity.query.filter_by(name='activity_2').first().delete()
+        resp = self.client.get('/projects',
+            headers={'Authorization': 'Bearer test_token'})
+        print(resp.data)
+        assert resp.status_code == 200
+        activities = resp.json.get('data')[0].get('activities')
+        assert [a.get('name') for a in activities] == ['activity_1']
+        assert 'cash_flow_json' not in activities[0]
+        assert len(resp.json.get('data')[0].get('inflow')) > 1
+
+    def test_move_activity(self):
+        '''
+        Test moving an activity to another project updates both aggregates
+        '''
+        first, second = [Project(name=name, created_by='1', contract_value=1000).commit()
+            for name in ['first', 'second']]
+        for project, name in [(first, 'a1'), (first, 'a2'), (second, 'b1')]:
+            resp = self.client.post(f'/new_activity/{project.id}',
+                headers={'Authorization': 'Bearer test_token'},
+                json={'name': name, 'cost': 1000, 'duration': 4})
+            assert resp.status_code == 201
+        first_id, second_id = first.id, second.id
+        for project in (first, second):
+            Project_cf(project)
+        activity = Activity.query.filter_by(name='a2').first()
+        resp = self.client.put(f'/update_activity/{activity.id}',
+            headers={'Authorization': 'Bearer test_token'},
+            json={'name': 'a2', 'cost': 1000, 'duration': 4, 'project_id': second_id})
+        print(resp.json)
+        assert resp.status_code == 200
+        for project_id, cost in [(first_id, 1000), (second_id, 2000)]:
+            project = Project.query.get(project_id)
+            assert project.cash_flow_json is not None
+            print(project_id, Project_cf(project).cost)
+            assert abs(Project_cf(project).cost - cost) < 1e-6
+
+        other = Project(name='other', created_by='2').commit()
+        resp = self.client.put(f'/update_activity/{activity.id}',
+            headers={'Authorization': 'Bearer test_token'},
+            json={'name': 'a2', 'cost': 1000, 'duration': 4, 'project_id': other.id})
+        assert resp.status_code != 200
+
+    def test_portfolio(self):
+        '''
+        Test the portfolio sums the projects cashflows on a common calendar
+        '''
+        first = Project(
+            name='first', created_by='1', contract_value=2000,
+            created_at=datetime(2024, 1, 15)).commit()
+        second = Project(
+            name='second', created_by='1', contract_value=3000,
+            created_at=datetime(2023, 11, 2), start_date='2024-03-20').commit()
+        Project(name='empty', created_by='1').commit()
+        for project in [first, second]:
+            resp = self.client.post(f'/new_activity/{project.id}',
+                headers={'Authorization': 'Bearer test_token'},
+                json={'name': 'activity', 'cost': 1000, 'duration': 4})
+            assert resp.status_code == 201
+        resp = self.client.get('/portfolio',
+            headers={'Authorization': 'Bearer test_token'})
+        print(resp.json)
+        assert resp.status_code == 200
+        data = resp.json.get('data')
+        assert data['start'] == '2024-01-01'
+        assert data['projects'] == 2
+        assert data['recomputed'] == 2
+
+        # the second project starts 2 months after the first one
+        expected = [0.0] * len(data['inflow'])
+        for project, offset in [(first, 0), (second, 2)]:
+            for i, value in enumerate(Project_cf(project).inflow()):
+                expected[offset + i] += value
+        for a, b in zip(data['inflow'], expected):
+            assert abs(a - b) < 1e-6
+        assert abs(data['cumulative_net'][-1] - (sum(data['inflow']) - sum(data['outflow']))) < 1e-6
+
+        # the snapshots are reused
+        resp = self.client.get('/portfolio',
+            headers={'Authorization': 'Bearer test_token'})
+        assert resp.json.get('data')['recomputed'] == 0
+        assert resp.json.get('data')['inflow'] == data['inflow']
+
+    def test_project_scenario(self):
+        '''
+        Test the scenario route computes the overridden cashflow without
+        changing the project
+        '''
+        project = Project(name='test_project', created_by='1', contract_value=5000).commit()
+        ids = []
+        for name in ['activity_1', 'activity_2']:
+            resp = self.client.post(f'/new_activity/{project.id}',
+                headers={'Authorization': 'Bearer test_token'},
+                json={'name': name, 'cost': 1000, 'duration': 4})
+            ids.append(resp.json['data']['id'])
+        stored = Activity.query.get(ids[0]).cash_flow_json
+        resp = self.client.post(f'/project/{project.id}/scenario',
+            headers={'Authorization': 'Bearer test_token'},
+            json={
+                'project': {'advance': 0.15, 'duration_for_payment': 2},
+                'activities': {ids[0]: {'duration': 8}, ids[1]: {'cost': 1000}},
+                })
+        print(resp.json)
+        assert resp.status_code == 200
+        data = resp.json['data']
+        assert data['recomputed'] == 1
+
+        # nothing is saved
+        project = Project.query.get(project.id)
+        assert project.advance == 0.1
+        assert Activity.query.get(ids[0]).duration == 4
+        assert Activity.query.get(ids[0]).cash_flow_json == stored
+
+        # same as applying the changes
+        project.advance = 0.15
+        project.duration_for_payment = 2
+        activity = Activity.query.get(ids[0])
+        activity.duration = 8
+        Activity_cf(activity).set_cashflow()
+        project.cash_flow_json = None
+        expected = Project_cf(project).inflow()
+        assert len(data['inflow']) == len(expected)
+        for a, b in zip(data['inflow'], expected):
+            assert abs(a - b) < 1e-6
+
+        resp = self.client.post(f'/project/{project.id}/scenario',
+            headers={'Authorization': 'Bearer test_token'},
+            json={'project': {'name': 'x'}})
+        assert resp.status_code == 400
+
+    def test_project_sensitivity(self):
+        '''
+        Test the sensitivity grid matches the cashflow of each grid point
+        '''
+        project = Project(name='test_project', created_by='1', contract_value=5000, dlp=3).commit()
+        for name, duration in [('activity_1', 4), ('activity_2', 7)]:
+            self.client.post(f'/new_activity/{project.id}',
+                headers={'Authorization': 'Bearer test_token'},
+                json={'name': name, 'cost': 1000, 'duration': duration, 'start': 1})
+        grid = {
+            'advance': [0, 0.1, 0.2], 'retention': [0.05, 0.4],
+            'duration_for_payment': [0, 2], 'wieb': [0, 0.5], 'dlp': [0, 12]}
+        resp = self.client.post(f'/project/{project.id}/sensitivity',
+            headers={'Authorization': 'Bearer test_token'}, json={'grid': grid})
+        print(resp.json)
+        assert resp.status_code == 200
+        data = resp.json['data']
+        assert sorted(data['terms']) == sorted(grid)
+        assert len(data['points']) == 48
+        project = Project.query.get(project.id)
+        for i in [0, 17, 47]:
+            point = Overlay(project, dict(zip(data['terms'], data['points'][i])))
+            point.dlp, point.duration_for_payment = int(point.dlp), int(point.duration_for_payment)
+            expected = Project_cf(point).analytics()
+            assert abs(data['metrics']['npv'][i] - expected['npv']) < 1e-6
+            assert abs(data['metrics']['peak_exposure'][i] - expected['peak_exposure']) < 1e-6
+            assert abs(data['metrics']['financing_cost'][i] - expected['financing_cost']) < 1e-6
+            assert abs(data['metrics']['final_cumulative_net'][i] - expected['cumulative_net'][-1]) < 1e-6
+
+        resp = self.client.post(f'/project/{project.id}/sensitivity',
+            headers={'Authorization': 'Bearer test_token'}, json={'grid': {'name': ['x']}})
+        assert resp.status_code == 400
+
+    def test_invalid_cash_flow_inputs(self):
+        '''
+        Test invalid cashflow inputs are rejected before any change
+        '''
+        project = Project(name='test_project', created_by='1', contract_value=5000).commit()
+        headers = {'Authorization': 'Bearer test_token'}
+        for data in [{'duration': 0}, {'skew': 1}, {'start': -2}, {'cost': -1000}]:
+            resp = self.client.post(f'/new_activity/{project.id}', headers=headers,
+                json=dict({'name': 'activity', 'cost': 1000, 'duration': 4}, **data))
+            print(resp.json)
+            assert resp.status_code == 400
+        assert Activity.query.filter_by(project_id=project.id).count() == 0
+
+        resp = self.client.put(f'/update_project/{project.id}', headers=headers,
+            json={'name': 'test_project', 'advance': 1.5})
+        print(resp.json)
+        assert resp.status_code == 400
+        assert Project.query.get(project.id).advance == 0.1
+        resp = self.client.put(f'/update_project/{project.id}', headers=headers,
+            json={'name': 'test_project', 'start_date': '2024-13-45'})
+        print(resp.json)
+        assert resp.status_code == 400
+
+        self.client.post(f'/new_activity/{project.id}', headers=headers,
+            json={'name': 'activity', 'cost': 1000, 'duration': 4})
+        activity = Activity.query.filter_by(project_id=project.id).one()
+        for fields in [{'duration': 0}, {'duration': 2.7}, {'is_deleted': 'no'}, {'cost': 'x'}]:
+            resp = self.client.post(f'/project/{project.id}/scenario', headers=headers,
+                json={'activities': {activity.id: fields}})
+            print(resp.json)
+            assert resp.status_code == 400
+        # same values as the updates
+        resp = self.client.post(f'/project/{project.id}/scenario', headers=headers,
+            json={'activities': {activity.id: {'duration': '5', 'is_deleted': 'false'}}})
+        assert resp.status_code == 200
+        resp = self.client.post(f'/project/{project.id}/sensitivity', headers=headers,
+            json={'grid': {'retention': [0.1, 2]}})
+        assert resp.status_code == 400
@@ -0,0 +1,295 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from time import sleep, time
+import asyncio
+import json
+import jwt
+from flask_testing import TestCase
+from q_flow.extensions import au_api, u_api
+from q_flow.services.single_flight import SingleFlight
+from q_flow.services.token_cache import TokenCache
+from tests.base import Base
+
+
+class Test_token_cache(Base, TestCase):
+    '''
+    Test the cache of verified user tokens
+    '''
+    def setUp(self):
+        self.app.config['TESTING'] = False
+        self.public_key, self.algo = u_api.public_key, u_api.algo
+        u_api.public_key, u_api.algo = 'test_secret', 'HS256'
+        u_api.token_cache.clear()
+
+    def tearDown(self):
+        self.app.config['TESTING'] = True
+        u_api.public_key, u_api.algo = self.public_key, self.algo
+        u_api.token_cache.clear()
+        super().tearDown()
+
+    def token(self, exp, **claims):
+        claims = dict({
+            'user_id': '1', 'email': 'test@example.com', 'is_active': True,
+            'client_app_id': u_api.app_id, 'aud': u_api.app_id, 'exp': exp}, **claims)
+        return jwt.encode(claims, 'test_secret', algorithm='HS256')
+
+    def test_verify_token_cache(self):
+        token = self.token(int(time()) + 60)
+        user = u_api.verify_token(token)
+        print(user)
+        assert user['user_id'] == '1' and user['name'] == 'test'
+        user['role'] = 'changed'
+        cached = u_api.verify_token(token)
+        assert 'role' not in cached and cached['token'] == token
+        info = u_api.token_cache_info()
+        print(info)
+        assert info['hits'] == 1 and info['misses'] == 1 and info['size'] == 1
+
+        # invalid tokens are not cached
+        bad = jwt.encode({'user_id': '1', 'exp': int(time()) + 60}, 'other', algorithm='HS256')
+        assert u_api.verify_token(bad).get('error')
+        assert u_api.token_cache_info()['size'] == 1
+
+    def test_expiry(self):
+        cache = TokenCache(maxsize=2)
+        cache.put('a', {'exp': time() + 60})
+        cache.put('b', {'exp': time() - 1})
+        cache.put('c', {'user_id': '1'})
+        assert cache.info()['size'] == 1
+        cache._claims[cache.key('a')] = (time() - 1, {})
+        assert cache.get('a') is None
+        assert cache.info()['expired'] == 1
+
+        for token in ['x', 'y', 'z']:
+            cache.put(token, {'exp': time() + 60})
+        assert cache.get('x') is None and cache.get('z') is not None
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        Handler.connections.add(self.client_address)
+        body = json.dumps({'message': 'ok', 'data': {'token': 'user_token'}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Test_user_api_session(Base, TestCase):
+    '''
+    Test the pooled QAuth session and the latency metrics
+    '''
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = u_api.url
+        u_api.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def tearDown(self):
+        u_api.url = self.url
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def test_keep_alive(self):
+        Handler.connections.clear()
+        for _ in range(3):
+            resp = u_api.post('user/login', data={'email': 'test@example.com'})
+            assert resp.status_code == 200 and resp.message == 'ok'
+        # the connection is reused
+        assert len(Handler.connections) == 1
+        assert u_api._session() is u_api._session()
+        sessions = []
+        thread = Thread(target=lambda: sessions.append(u_api._session()))
+        thread.start()
+        thread.join()
+        assert sessions[0] is not u_api._session()
+
+        stats = u_api.latency_info()['user/login']
+        print(stats)
+        assert stats['count'] >= 3 and stats['errors'] == 0
+        assert 0 < stats['mean'] <= stats['max']
+
+
+class RefreshHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    calls = 0
+    status = 200
+    ttl = 60
+    connections = set()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        RefreshHandler.calls += 1
+        RefreshHandler.connections.add(self.client_address)
+        sleep(0.2)
+        token = jwt.encode({
+            'user_id': '1', 'email': 'test@example.com', 'is_active': True,
+            'client_app_id': u_api.app_id, 'aud': u_api.app_id,
+            'exp': int(time()) + RefreshHandler.ttl, 'call': RefreshHandler.calls}, 'test_secret', algorithm='HS256')
+        body = json.dumps({'message': 'refresh', 'data': {'token': token}}).encode()
+        self.send_response(RefreshHandler.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Test_token_refresh(Base, TestCase):
+    '''
+    Test the parallel refreshes of an expired token share one QAuth call
+    '''
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), RefreshHandler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.saved = u_api.url, u_api.public_key, u_api.algo
+        u_api.url = f'http://127.0.0.1:{self.server.server_port}'
+        u_api.public_key, u_api.algo = 'test_secret', 'HS256'
+        u_api.refreshes.clear()
+        self.app.config['TESTING'] = False
+        RefreshHandler.calls, RefreshHandler.status, RefreshHandler.ttl = 0, 200, 60
+
+    def tearDown(self):
+        self.app.config['TESTING'] = True
+        u_api.url, u_api.public_key, u_api.algo = self.saved
+        u_api.refreshes.clear()
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def expired_token(self):
+        return jwt.encode({
+            'user_id': '1', 'client_app_id': u_api.app_id, 'aud': u_api.app_id,
+            'exp': int(time()) - 10, 'jti': str(time())}, 'test_secret', algorithm='HS256')
+
+    def verify_in_threads(self, token, count=10):
+        results = []
+        def verify():
+            with self.app.app_context():
+                results.append(u_api.verify_token(token))
+        threads = [Thread(target=verify) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_single_flight(self):
+        results = self.verify_in_threads(self.expired_token())
+        print(u_api.refreshes.info())
+        assert RefreshHandler.calls == 1
+        assert len({r['token'] for r in results}) == 1
+        assert all(r['call'] == 1 for r in results)
+
+    def test_failed_refresh(self):
+        RefreshHandler.status = 401
+        token = self.expired_token()
+        results = self.verify_in_threads(token, 3)
+        assert all(r.get('error') for r in results)
+        assert RefreshHandler.calls == 1
+        # the failure is kept for a few seconds
+        with self.app.app_context():
+            assert u_api.verify_token(token).get('error')
+        assert RefreshHandler.calls == 1
+        assert u_api.refreshes.info()['cached_failures'] == 1
+
+    def test_failures_bounded(self):
+        def fail():
+            raise ValueError('refresh failed')
+
+        refreshes = SingleFlight(failure_ttl=0.05, max_failures=10)
+        for key in range(50):
+            with self.assertRaises(ValueError):
+                refreshes.do(key, fail)
+        print(refreshes.info())
+        assert len(refreshes._failures) == 10
+        assert list(refreshes._failures) == list(range(40, 50))
+        # the expired failures are dropped by the next call
+        sleep(0.1)
+        assert refreshes.do('other', lambda: 1) == 1
+        assert len(refreshes._failures) == 0
+
+    def test_bounded_refresh(self):
+        # the refreshed token is expired too
+        RefreshHandler.ttl = -10
+        with self.app.app_context():
+            result = u_api.verify_token(self.expired_token())
+        print(result)
+        assert 'expired' in result['error']
+        assert RefreshHandler.calls == 1
+
+
+class Test_async_user_api(Base, TestCase):
+    '''
+    Test the async QAuth client and the async user views
+    '''
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), RefreshHandler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.saved = u_api.url, u_api.public_key, u_api.algo
+        u_api.url = f'http://127.0.0.1:{self.server.server_port}'
+        u_api.public_key, u_api.algo = 'test_secret', 'HS256'
+        u_api.refreshes.clear()
+        RefreshHandler.calls, RefreshHandler.status, RefreshHandler.ttl = 0, 200, 60
+
+    def tearDown(self):
+        self.app.config['TESTING'] = True
+        u_api.url, u_api.public_key, u_api.algo = self.saved
+        u_api.refreshes.clear()
+        self.server.shutdown()
+        self.server.server_close()
+        super().tearDown()
+
+    def test_post(self):
+        RefreshHandler.connections.clear()
+        # each asyncio.run is a new loop, like the requests of the async views
+        for _ in range(3):
+            resp = asyncio.run(au_api.post('user/login', data={'email': 'test@example.com'}))
+            assert resp.status_code == 200 and resp.message == 'refresh'
+        assert resp.response.json()['data']['token']
+        assert u_api.latency_info()['user/login']['count'] >= 3
+        # the connection is reused
+        assert len(RefreshHandler.connections) == 1
+
+        # blocking calls run in the threads of the background loop
+        assert asyncio.run(au_api.to_thread(sum, [1, 2], start=3)) == 6
+
+        u_api.url = 'http://127.0.0.1:1'
+        resp = asyncio.run(au_api.get('user/info'))
+        print(resp.status_code, resp.message)
+        assert resp.status_code == 503
+
+    def test_login_view(self):
+        resp = self.client.post('/login', json={'email': 'test@example.com', 'password': 'x'})
+        print(resp.json)
+        assert resp.status_code == 200
+        assert resp.json['data']['token'] and resp.json['data']['user']['user_id'] == '1'
+        assert RefreshHandler.calls == 1
+
+        RefreshHandler.status = 400
+        resp = self.client.post('/register', json={'email': 'test@example.com', 'password': 'x'})
+        assert resp.status_code == 400
+
+    def test_single_flight(self):
+        self.app.config['TESTING'] = False
+        token = jwt.encode({
+            'user_id': '1', 'client_app_id': u_api.app_id, 'aud': u_api.app_id,
+            'exp': int(time()) - 10}, 'test_secret', algorithm='HS256')
+
+        async def verify():
+            return await asyncio.gather(*[au_api.verify_token(token) for _ in range(5)])
+        results = asyncio.run(verify())
+        print(u_api.refreshes.info())
+        assert RefreshHandler.calls == 1
+        assert all(r['call'] == 1 for r in results)